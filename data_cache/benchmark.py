@@ -0,0 +1,196 @@
+# benchmark.py
+# Measure fetcher throughput offline against data_cache.mock_api.
+# Starts the mock server in a subprocess, points the fetchers at it and
+# reports pages/s, records/s, peak RSS and limiter sleep time per fetcher.
+# Each fetcher runs in its own process, so its peak RSS is its own.
+#
+# python -m data_cache.benchmark --orders 5000 --shards 4
+
+###########
+# IMPORTS #
+###########
+
+# Import Packages #
+import argparse
+import os
+import resource
+import socket
+import subprocess
+import sys
+import time
+
+# Import local modules #
+# (fetcher modules are imported in run_fetcher, after the base URLs point at
+# the mock)
+
+# Fetchers benchmarked by main, in order
+FETCHERS = ['shopify', 'recharge', 'yotpo']
+
+##############
+# Benchmarks #
+##############
+
+
+def free_port():
+    '''Return a localhost port that is free right now'''
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+
+def start_mock_api(port, args):
+    '''Start data_cache.mock_api in a subprocess and wait until it listens
+
+    Keyword arguments:
+    port -- port for the mock server
+    args -- parsed benchmark arguments with the mock data sizes
+    '''
+    process = subprocess.Popen([
+        sys.executable, '-m', 'data_cache.mock_api',
+        '--port', str(port),
+        '--orders', str(args.orders),
+        '--subscriptions', str(args.subscriptions),
+        '--customers', str(args.customers),
+        '--latency', str(args.latency),
+    ], stdout=subprocess.DEVNULL)
+    deadline = time.monotonic() + 10
+    while time.monotonic() < deadline:
+        try:
+            socket.create_connection(('127.0.0.1', port), timeout=1).close()
+            return process
+        except OSError:
+            time.sleep(0.1)
+    process.kill()
+    raise RuntimeError('Mock API did not start')
+
+
+def peak_rss_mb():
+    '''Return the peak resident set size of this process in MB'''
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # ru_maxrss is in kilobytes on Linux and bytes on macOS
+    return peak / (1024 * 1024 if sys.platform == 'darwin' else 1024)
+
+
+def run_benchmark(name, fetch, limiter):
+    '''Run fetch and print its throughput
+
+    Keyword arguments:
+    name -- fetcher name for the report
+    fetch -- callable returning an iterable of record pages
+    limiter -- the rate_limit.RateLimiter fetch uses
+    '''
+    start = time.monotonic()
+    pages = records = 0
+    for page in fetch():
+        pages += 1
+        records += len(page)
+    seconds = time.monotonic() - start
+    print(f'{name:<10} {pages:>6} pages {records:>8} records '
+          f'{seconds:>7.2f}s {pages / seconds:>8.1f} pages/s '
+          f'{records / seconds:>9.0f} records/s '
+          f'slept {limiter.slept:>6.2f}s '
+          f'retries {limiter.retries:>3} '
+          f'peak RSS {peak_rss_mb():>6.0f}MB')
+
+
+def run_fetcher(name, args):
+    '''Benchmark one fetcher against the mock APIs at args.base_url
+
+    Keyword arguments:
+    name -- fetcher to run (one of FETCHERS)
+    args -- parsed benchmark arguments
+    '''
+    os.environ['SHOPIFY_API_URL'] = args.base_url
+    os.environ['RECHARGE_API_URL'] = args.base_url
+    os.environ['YOTPO_API_URL'] = args.base_url
+
+    from data_cache.config import SHARD_START
+    from data_cache.pagination import date_windows, iter_sharded_pages
+    from data_cache.rate_limit import (RateLimiter, recharge_limiter,
+                                       shopify_limiter)
+    from data_cache.update_active_table import get_shopify_order_api
+    from data_cache.update_cancel_table import get_recharge_sub_api
+    from data_cache.yotpo import YOTPO_REQUESTS_PER_SECOND, get_yotpo_balances
+    import pandas as pd
+
+    if name == 'shopify':
+        limiter = shopify_limiter()
+
+        def fetch_orders():
+            def fetch_window(created_at_min, created_at_max, page_url):
+                return get_shopify_order_api(
+                    endpoint='admin/api/2021-07/orders.json',
+                    status='any',
+                    limiter=limiter,
+                    created_at_min=created_at_min,
+                    created_at_max=created_at_max,
+                    page_url=page_url,
+                )
+            windows = date_windows(pd.Timestamp(SHARD_START, tz='UTC'),
+                                   pd.Timestamp.now(tz='UTC'), args.shards)
+            for index, records, next_url in iter_sharded_pages(fetch_window,
+                                                               windows):
+                yield records
+        run_benchmark('shopify', fetch_orders, limiter)
+
+    elif name == 'recharge':
+        limiter = recharge_limiter()
+
+        def fetch_subscriptions():
+            pages = get_recharge_sub_api(status='CANCELLED', limiter=limiter)
+            for records, next_url in pages:
+                yield records
+        run_benchmark('recharge', fetch_subscriptions, limiter)
+
+    elif name == 'yotpo':
+        limiter = RateLimiter(YOTPO_REQUESTS_PER_SECOND)
+        emails = [f'customer{index}@example.com'
+                  for index in range(args.yotpo_emails)]
+        # One balance per "page"
+        run_benchmark(
+            'yotpo',
+            lambda: ([balance] for balance in get_yotpo_balances(
+                emails, limiter=limiter)['yotpo_point_balance']),
+            limiter,
+        )
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description='Benchmark the API fetchers against the local mock APIs')
+    parser.add_argument('--orders', type=int, default=5000)
+    parser.add_argument('--subscriptions', type=int, default=6000)
+    parser.add_argument('--customers', type=int, default=500)
+    parser.add_argument('--latency', type=float, default=0.05,
+                        help='seconds the mock adds to every response')
+    parser.add_argument('--shards', type=int, default=1,
+                        help='created_at windows fetched in parallel')
+    parser.add_argument('--yotpo-emails', type=int, default=200,
+                        help='balances looked up in the Yotpo benchmark')
+    # Set by main for the process running a single fetcher
+    parser.add_argument('--fetcher', choices=FETCHERS, help=argparse.SUPPRESS)
+    parser.add_argument('--base-url', help=argparse.SUPPRESS)
+    args = parser.parse_args()
+    if args.fetcher is not None:
+        run_fetcher(args.fetcher, args)
+        return
+
+    port = free_port()
+    base_url = f'http://127.0.0.1:{port}'
+    process = start_mock_api(port, args)
+    try:
+        print(f'Mock APIs on {base_url}: {args.orders} orders, '
+              f'{args.subscriptions} subscriptions, {args.latency}s latency',
+              flush=True)
+        for name in FETCHERS:
+            subprocess.run([
+                sys.executable, '-m', 'data_cache.benchmark', *sys.argv[1:],
+                '--fetcher', name, '--base-url', base_url,
+            ], check=True)
+    finally:
+        process.terminate()
+        process.wait()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,20 @@
+# config.py
+# Base URLs of the Shopify, Recharge and Yotpo APIs and the start of the
+# sharded created_at range, shared by every fetcher. Point the URLs at
+# data_cache.mock_api to benchmark offline (see data_cache.benchmark).
+
+###########
+# IMPORTS #
+###########
+
+# Import .env variables #
+from dotenv import load_dotenv
+import os
+load_dotenv()  # take environment variables from .env
+SHOPIFY_API_URL = os.getenv('SHOPIFY_API_URL',
+                            'https://the-good-kitchen-esc.myshopify.com')
+RECHARGE_API_URL = os.getenv('RECHARGE_API_URL', 'https://api.rechargeapps.com')
+YOTPO_API_URL = os.getenv('YOTPO_API_URL', 'https://loyalty.yotpo.com')
+
+# Sharded fetches split created_at into equal windows from this date to now
+SHARD_START = '2019-01-01'
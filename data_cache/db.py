@@ -0,0 +1,97 @@
+# db.py
+# One pooled SQLAlchemy engine per process for the Dash pages, the ETL
+# scripts and db_tools, with slow query logging and chunked reads.
+
+###########
+# IMPORTS #
+###########
+
+# Import Packages #
+import os
+import threading
+import time
+import pandas as pd
+from sqlalchemy import create_engine, event, exc, text
+
+# Import .env variables #
+from dotenv import load_dotenv
+load_dotenv()  # take environment variables from .env
+DATABASE_URL = os.getenv('DATABASE_URL')
+# Connections kept open per process, and extra ones allowed under load
+DB_POOL_SIZE = int(os.getenv('DB_POOL_SIZE', 5))
+DB_MAX_OVERFLOW = int(os.getenv('DB_MAX_OVERFLOW', 2))
+# Queries slower than this many seconds are logged
+DB_SLOW_QUERY_SECONDS = float(os.getenv('DB_SLOW_QUERY_SECONDS', 1))
+
+_engine = None
+_engine_lock = threading.Lock()
+
+
+def database_url():
+    '''Return DATABASE_URL with the 'postgresql' prefix sqlalchemy expects'''
+    return DATABASE_URL.replace('postgres://', 'postgresql://', 1)
+
+
+def make_engine(url=None, pool_size=DB_POOL_SIZE, max_overflow=DB_MAX_OVERFLOW,
+                slow_query_seconds=DB_SLOW_QUERY_SECONDS):
+    '''Return a new pooled engine with fork protection and slow query logging
+
+    Keyword arguments:
+    url -- database URL (default DATABASE_URL)
+    pool_size -- connections kept open in the pool
+    max_overflow -- connections opened beyond pool_size under load
+    slow_query_seconds -- log statements that take longer than this
+    '''
+    engine = create_engine(
+        url or database_url(),
+        pool_size=pool_size,
+        max_overflow=max_overflow,
+        pool_pre_ping=True,
+    )
+
+    # A forked worker (gunicorn --preload) must not reuse the sockets of
+    # connections its parent opened; they are dropped and reopened.
+    @event.listens_for(engine, 'connect')
+    def remember_pid(dbapi_connection, connection_record):
+        connection_record.info['pid'] = os.getpid()
+
+    @event.listens_for(engine, 'checkout')
+    def check_pid(dbapi_connection, connection_record, connection_proxy):
+        if connection_record.info['pid'] != os.getpid():
+            connection_record.connection = connection_proxy.connection = None
+            raise exc.DisconnectionError(
+                'Connection belongs to a parent process')
+
+    @event.listens_for(engine, 'before_cursor_execute')
+    def start_timer(conn, cursor, statement, parameters, context, executemany):
+        conn.info['query_start'] = time.perf_counter()
+
+    @event.listens_for(engine, 'after_cursor_execute')
+    def log_slow_query(conn, cursor, statement, parameters, context,
+                       executemany):
+        seconds = time.perf_counter() - conn.info['query_start']
+        if seconds > slow_query_seconds:
+            print(f'Slow query ({seconds:.2f}s): {" ".join(statement.split())}')
+
+    return engine
+
+
+def get_engine():
+    '''Return the engine shared by everything in this process'''
+    global _engine
+    with _engine_lock:
+        if _engine is None:
+            _engine = make_engine()
+        return _engine
+
+
+def read_sql(query, params=None):
+    '''Run a query on a pooled connection and return a DataFrame
+
+    Keyword arguments:
+    query -- SQL with :name placeholders
+    params -- dictionary of placeholder values
+    '''
+    with get_engine().connect() as con:
+        return pd.read_sql(text(query), con, params=params)
+
@@ -1,12 +1,7 @@
-# import the relevant sql library
-from sqlalchemy import create_engine
 import pandas as pd
 
-# Import .env variables #
-from dotenv import load_dotenv
-import os
-load_dotenv()  # take environment variables from .env
-DATABASE_URL = os.getenv('DATABASE_URL')
+# Import local modules #
+from data_cache.db import get_engine
 
 # Example dataframe
 data = {'Name': ['Tom', 'nick', 'krish', 'jack'],
@@ -15,7 +10,7 @@ df = pd.DataFrame(data)
 
 
 # link to your database
-engine = create_engine(DATABASE_URL, echo=False)
+engine = get_engine()
 # attach the data frame (df) to the database with a name of the
 # table; the name can be whatever you like
 df.to_sql('test_db', con=engine, if_exists='append')
@@ -1,17 +1,5 @@
-import pandas as pd
-import psycopg2
-
-# Import .env variables #
-from dotenv import load_dotenv
-import os
-load_dotenv()  # take environment variables from .env
-DATABASE_URL = os.getenv('DATABASE_URL')
-
-# create a new database connection by calling the connect() function
-con = psycopg2.connect(DATABASE_URL)
-
-#  create a new cursor
-cur = con.cursor()
+# Import local modules #
+from data_cache.db import read_sql
 
 # query
 query = f"""SELECT *
@@ -19,6 +7,6 @@ query = f"""SELECT *
             """
 
 # return results as a dataframe
-results = pd.read_sql(query, con)
+results = read_sql(query)
 
 print(results.head())
@@ -1,18 +1,14 @@
 # import the relevant sql library
 from sqlalchemy import MetaData
-from sqlalchemy import create_engine
 # from sqlalchemy.engine.url import URL
 from sqlalchemy.ext.declarative import declarative_base
 
-# Import .env variables #
-from dotenv import load_dotenv
-import os
-load_dotenv()  # take environment variables from .env
-DATABASE_URL = os.getenv('DATABASE_URL')
+# Import local modules #
+from data_cache.db import get_engine
 
 
 # delete table
-engine = create_engine(DATABASE_URL, echo=False)
+engine = get_engine()
 
 def drop_table(table_name, engine=engine):
     Base = declarative_base()
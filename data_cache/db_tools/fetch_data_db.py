@@ -1,15 +1,12 @@
 # import the relevant sql library
-from sqlalchemy import create_engine
-
-# Import .env variables #
-from dotenv import load_dotenv
-import os
-load_dotenv()  # take environment variables from .env
-DATABASE_URL = os.getenv('DATABASE_URL')
+from sqlalchemy import text
 
+# Import local modules #
+from data_cache.db import get_engine
 
 # link to your database
-engine = create_engine(DATABASE_URL, echo=False)
+engine = get_engine()
 
 # run a quick test
-print(engine.execute('SELECT * FROM cancel_db').fetchone())
+with engine.connect() as con:
+    print(con.execute(text('SELECT * FROM cancel_db')).fetchone())
@@ -0,0 +1,116 @@
+# dtypes.py
+# Compact pandas dtypes for the cache tables. Frames loaded from the API,
+# PostgreSQL or a snapshot are converted here, so repeated strings are not
+# held once per row and timestamps and integers are not Python objects.
+
+###########
+# IMPORTS #
+###########
+
+# Import Packages #
+import numpy as np
+import pandas as pd
+
+# Import .env variables #
+from dotenv import load_dotenv
+import os
+load_dotenv()  # take environment variables from .env
+# Time zone of the shop, whose wall time the TIMESTAMP columns hold
+SHOP_TZ = os.getenv('SHOP_TZ', 'America/New_York')
+
+# Import local modules #
+from data_cache.schema import TABLE_COLUMNS
+
+# Text columns with few distinct values, held as categoricals
+CATEGORY_COLUMNS = {'cancellation_reason', 'sku'}
+# Text columns with many repeated values that are used as join and filter
+# keys. They stay strings, since a categorical key makes pandas group by
+# every category, but each distinct value is stored once.
+INTERNED_COLUMNS = {'email'}
+
+
+def column_dtype(column, column_type):
+    '''Return the compact dtype of a cache table column
+
+    Keyword arguments:
+    column -- column name
+    column_type -- SQL definition from schema.TABLE_COLUMNS
+    '''
+    sql_type = column_type.split()[0]
+    nullable = 'NOT NULL' not in column_type and 'PRIMARY KEY' not in column_type
+    if column in CATEGORY_COLUMNS:
+        return 'category'
+    if column in INTERNED_COLUMNS:
+        return 'interned'
+    if sql_type == 'TIMESTAMP':
+        return 'datetime64[ns]'
+    if sql_type == 'INTEGER':
+        return 'Int32' if nullable else 'int32'
+    if sql_type == 'BIGINT':
+        return 'Int64' if nullable else 'int64'
+    if sql_type == 'DOUBLE':
+        return 'float64'
+    return 'object'
+
+
+# Compact dtype of every column of each cache table
+TABLE_DTYPES = {
+    table: {column: column_dtype(column, column_type)
+            for column, column_type in columns}
+    for table, columns in TABLE_COLUMNS.items()
+}
+
+
+def intern_strings(series):
+    '''Return series with one shared object per distinct string
+
+    Keyword arguments:
+    series -- Series of strings (missing values become None)
+    '''
+    codes, uniques = pd.factorize(series)
+    # Code -1 (missing) picks the None appended to the distinct values
+    values = np.append(np.asarray(uniques, dtype=object), None)
+    return pd.Series(values[codes], index=series.index, name=series.name)
+
+
+def wall_time(series):
+    '''Return series as naive datetime64 in the shop's wall time
+
+    Shopify timestamps carry the shop's offset, which changes with DST, so
+    one page can mix -05:00 and -04:00. Values with an offset are converted
+    to SHOP_TZ and their offset dropped, as PostgreSQL does when it stores
+    them in a TIMESTAMP column. Naive values are already wall times and are
+    parsed as they are.
+
+    Keyword arguments:
+    series -- Series of timestamps, datetimes or ISO 8601 strings
+    '''
+    if isinstance(series.dtype, pd.DatetimeTZDtype):
+        return series.dt.tz_convert(SHOP_TZ).dt.tz_localize(None)
+    values = series.dropna()
+    if len(values) and pd.Timestamp(values.iloc[0]).tzinfo is not None:
+        return (pd.to_datetime(series, utc=True)
+                .dt.tz_convert(SHOP_TZ).dt.tz_localize(None))
+    return pd.to_datetime(series)
+
+
+def compact_frame(df, table):
+    '''Return df with the compact dtypes of table's columns
+
+    Columns of df that are not columns of table are left as they are.
+
+    Keyword arguments:
+    df -- DataFrame of rows of a cache table
+    table -- cache table (key of schema.TABLE_COLUMNS)
+    '''
+    df = df.copy(deep=False)
+    for column, dtype in TABLE_DTYPES[table].items():
+        if column not in df.columns or str(df[column].dtype) == dtype:
+            continue
+        if dtype == 'interned':
+            df[column] = intern_strings(df[column])
+        elif dtype == 'datetime64[ns]':
+            df[column] = wall_time(df[column])
+        else:
+            df[column] = df[column].astype(dtype)
+    return df
@@ -0,0 +1,166 @@
+# etl_state.py
+# Persist small pieces of ETL state (sync watermarks, checkpoints)
+# in the database so scheduled jobs can pick up where the last run stopped.
+
+###########
+# IMPORTS #
+###########
+
+# Import Packages #
+import hashlib
+import json
+import pandas as pd
+from sqlalchemy import text
+
+STATE_TABLE = 'etl_state'
+
+
+def ensure_state_table(engine):
+    '''Create the ETL state table if it does not exist yet
+
+    Keyword arguments:
+    engine -- sqlalchemy engine or connection
+    '''
+    with engine.begin() as con:
+        con.execute(text(f'''
+            CREATE TABLE IF NOT EXISTS {STATE_TABLE} (
+                name TEXT PRIMARY KEY,
+                value TEXT,
+                updated_at TIMESTAMPTZ NOT NULL DEFAULT now()
+            )
+        '''))
+
+
+def get_state(engine, name, default=None):
+    '''Return the stored value for name, or default if it is not set
+
+    Keyword arguments:
+    engine -- sqlalchemy engine
+    name -- state key (e.g. 'active_sub.updated_at')
+    default -- value returned when no state is stored
+    '''
+    ensure_state_table(engine)
+    with engine.connect() as con:
+        value = con.execute(
+            text(f'SELECT value FROM {STATE_TABLE} WHERE name = :name'),
+            {'name': name},
+        ).scalar()
+    return default if value is None else value
+
+
+def set_state(con, name, value):
+    '''Insert or update the stored value for name
+
+    Pass the connection of an open transaction so the state only
+    commits together with the data it describes.
+
+    Keyword arguments:
+    con -- sqlalchemy connection inside a transaction
+    name -- state key
+    value -- string value to store
+    '''
+    con.execute(
+        text(f'''
+            INSERT INTO {STATE_TABLE} (name, value, updated_at)
+            VALUES (:name, :value, now())
+            ON CONFLICT (name)
+            DO UPDATE SET value = EXCLUDED.value, updated_at = EXCLUDED.updated_at
+        '''),
+        {'name': name, 'value': value},
+    )
+
+
+def touch_state(con, name):
+    '''Mark the stored value for name as updated without changing it
+
+    Readers that use updated_at as the version of the data behind a state
+    key see a new version once the transaction commits.
+
+    Keyword arguments:
+    con -- sqlalchemy connection inside a transaction
+    name -- state key
+    '''
+    con.execute(
+        text(f'UPDATE {STATE_TABLE} SET updated_at = now() WHERE name = :name'),
+        {'name': name},
+    )
+
+
+def delete_state(con, name):
+    '''Remove the stored value for name
+
+    Keyword arguments:
+    con -- sqlalchemy connection inside a transaction
+    name -- state key
+    '''
+    con.execute(
+        text(f'DELETE FROM {STATE_TABLE} WHERE name = :name'),
+        {'name': name},
+    )
+
+
+def latest_update(records, last_seen=None):
+    '''Return the newest updated_at in records and last_seen
+
+    Keyword arguments:
+    records -- dictionary of records from API
+    last_seen -- newest updated_at Timestamp seen so far
+    '''
+    updates = [pd.Timestamp(record['updated_at']) for record in records]
+    if last_seen is not None:
+        updates.append(last_seen)
+    return max(updates, default=None)
+
+
+def record_fingerprint(record):
+    '''Return a hash of the content of an API record
+
+    Keyword arguments:
+    record -- dictionary of one record from API
+    '''
+    content = json.dumps(record, sort_keys=True, default=str)
+    return hashlib.sha1(content.encode()).hexdigest()
+
+
+class ChangeFilter:
+    '''Drop fetched records that the previous sync already loaded
+
+    Delta syncs fetch from updated_at_min on, so the records at (or, with
+    an overlap, shortly before) the last stored watermark come back on
+    every run. Their fingerprints are stored with the watermark, and a
+    page of records that are all unchanged is not transformed or loaded.
+
+    Keyword arguments:
+    seen -- fingerprints stored by the previous sync
+    '''
+
+    def __init__(self, seen=()):
+        self.seen = set(seen)
+        # fingerprint -> updated_at of every record fetched in this run
+        self.fetched = {}
+
+    def new_records(self, records):
+        '''Return the records whose content the previous sync did not load
+
+        Keyword arguments:
+        records -- dictionary of records from API
+        '''
+        changed = []
+        for record in records:
+            fingerprint = record_fingerprint(record)
+            self.fetched[fingerprint] = pd.Timestamp(record['updated_at'])
+            if fingerprint not in self.seen:
+                changed.append(record)
+        return changed
+
+    def since(self, updated_at_min):
+        '''Return the fingerprints of fetched records that the next sync
+        will fetch again, as a JSON list to store
+
+        Keyword arguments:
+        updated_at_min -- updated_at_min of the next sync
+        '''
+        return json.dumps(sorted(
+            fingerprint for fingerprint, updated_at in self.fetched.items()
+            if updated_at >= updated_at_min
+        ))
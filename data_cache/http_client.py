@@ -0,0 +1,87 @@
+# http_client.py
+# One pooled HTTP session shared by every fetcher (Shopify, Recharge, Yotpo),
+# so pages and lookups reuse keep-alive connections instead of opening a new
+# TLS connection per request.
+
+###########
+# IMPORTS #
+###########
+
+# Import Packages #
+import os
+import threading
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util import Retry, make_headers
+
+# Import .env variables #
+from dotenv import load_dotenv
+load_dotenv()  # take environment variables from .env
+# Seconds to wait for a connection and for each read of a response
+HTTP_CONNECT_TIMEOUT = float(os.getenv('HTTP_CONNECT_TIMEOUT', 5))
+HTTP_READ_TIMEOUT = float(os.getenv('HTTP_READ_TIMEOUT', 60))
+# Keep-alive connections per host; further requests wait for a free one
+HTTP_POOL_SIZE = int(os.getenv('HTTP_POOL_SIZE', 10))
+
+# Retries of connection failures and dropped reads. Status codes (429, 5xx)
+# are retried by rate_limit.RateLimiter, which also paces the retry.
+CONNECTION_RETRY = Retry(
+    total=3,
+    connect=3,
+    read=2,
+    status=0,
+    backoff_factor=0.5,
+    raise_on_status=False,
+)
+
+_session = None
+_session_pid = None
+_session_lock = threading.Lock()
+
+
+class TimeoutSession(requests.Session):
+    '''requests Session that applies a default timeout to every request'''
+
+    def __init__(self, timeout):
+        super().__init__()
+        self.timeout = timeout
+
+    def request(self, method, url, **kwargs):
+        kwargs.setdefault('timeout', self.timeout)
+        return super().request(method, url, **kwargs)
+
+
+def make_session(pool_size=HTTP_POOL_SIZE,
+                 timeout=(HTTP_CONNECT_TIMEOUT, HTTP_READ_TIMEOUT)):
+    '''Return a new session with pooled connections, retries and compression
+
+    Keyword arguments:
+    pool_size -- keep-alive connections kept per host
+    timeout -- (connect, read) seconds applied when a request sets none
+    '''
+    session = TimeoutSession(timeout)
+    adapter = HTTPAdapter(
+        pool_connections=pool_size,
+        pool_maxsize=pool_size,
+        pool_block=True,
+        max_retries=CONNECTION_RETRY,
+    )
+    session.mount('https://', adapter)
+    session.mount('http://', adapter)
+    # gzip and deflate, plus br when brotli is installed
+    session.headers.update(make_headers(accept_encoding=True))
+    return session
+
+
+def shared_session():
+    '''Return the session shared by all fetchers of this process
+
+    A forked worker (gunicorn) gets its own session instead of reusing the
+    parent's sockets.
+    '''
+    global _session, _session_pid
+    with _session_lock:
+        if _session is None or _session_pid != os.getpid():
+            _session = make_session()
+            _session_pid = os.getpid()
+        return _session
@@ -0,0 +1,152 @@
+# loader.py
+# Load DataFrames into PostgreSQL with COPY FROM STDIN, and rebuild tables in
+# a staging table that is swapped in with a rename, so readers never see a
+# dropped or half-written table.
+
+###########
+# IMPORTS #
+###########
+
+# Import Packages #
+import io
+import pandas as pd
+from sqlalchemy import text
+
+# Import local modules #
+from data_cache.schema import (TABLE_INDEXES, TABLE_PARTITIONS,
+                               create_indexes, create_partitions, create_table,
+                               index_name, partition_months, partition_name)
+
+
+def staging_table(table):
+    '''Return the name of the staging table used to rebuild table'''
+    return f'{table}_staging'
+
+
+def copy_rows(con, df, table, schema_table=None):
+    '''Append the rows of df to table with COPY FROM STDIN
+
+    Rows are sent as CSV in one COPY instead of multi-row INSERTs. The
+    monthly partitions the rows fall into are created first.
+
+    Keyword arguments:
+    con -- sqlalchemy connection inside a transaction
+    df -- DataFrame whose columns are columns of the table
+    table -- target table
+    schema_table -- cache table that table holds rows of (default table,
+                    e.g. 'cancel_db' for its staging table)
+    '''
+    if df.empty:
+        return
+    schema_table = schema_table or table
+    if schema_table in TABLE_PARTITIONS:
+        create_partitions(con, schema_table,
+                          partition_months(df, schema_table), name=table)
+    buffer = io.StringIO()
+    df.to_csv(buffer, index=False, header=False)
+    buffer.seek(0)
+    columns = ', '.join(f'"{column}"' for column in df.columns)
+    cursor = con.connection.cursor()
+    try:
+        cursor.copy_expert(
+            f'COPY {table} ({columns}) FROM STDIN WITH (FORMAT csv)', buffer)
+    finally:
+        cursor.close()
+
+
+def create_staging_table(con, table):
+    '''Create an empty staging table to rebuild table in
+
+    A staging table left over from an earlier rebuild is dropped first.
+
+    Keyword arguments:
+    con -- sqlalchemy connection inside a transaction
+    table -- live table name (key of schema.TABLE_COLUMNS)
+    '''
+    con.execute(text(f'DROP TABLE IF EXISTS {staging_table(table)}'))
+    create_table(con, table, name=staging_table(table))
+
+
+def swap_table(con, table):
+    '''Index the staging table of table and swap it in for the live table
+
+    Run inside the transaction that commits the load (or a new one). The
+    old table is dropped and the staging table renamed in one transaction,
+    so readers see either the complete old table or the complete new one.
+    Partitions of the staging table are renamed with it.
+
+    Keyword arguments:
+    con -- sqlalchemy connection inside a transaction
+    table -- live table name (key of schema.TABLE_INDEXES)
+    '''
+    staging = staging_table(table)
+    # Build indexes before the swap so the live table is never unindexed
+    create_indexes(con, table, name=staging)
+    con.execute(text(f'DROP TABLE IF EXISTS {table}'))
+    con.execute(text(f'ALTER TABLE {staging} RENAME TO {table}'))
+    for columns in TABLE_INDEXES[table]:
+        con.execute(text(
+            f'ALTER INDEX {index_name(staging, columns)} '
+            f'RENAME TO {index_name(table, columns)}'
+        ))
+    partitions = con.execute(
+        text('''
+            SELECT c.relname FROM pg_inherits i
+            JOIN pg_class c ON c.oid = i.inhrelid
+            WHERE i.inhparent = to_regclass(:table)
+        '''),
+        {'table': table},
+    ).scalars().all()
+    for partition in partitions:
+        if partition.startswith(f'{staging}_'):
+            con.execute(text(
+                f'ALTER TABLE {partition} RENAME TO '
+                f'{table}_{partition[len(staging) + 1:]}'
+            ))
+
+
+def create_partition_staging(con, table, month):
+    '''Create an empty staging table to rebuild one monthly partition in
+
+    Keyword arguments:
+    con -- sqlalchemy connection inside a transaction
+    table -- partitioned cache table (key of schema.TABLE_PARTITIONS)
+    month -- month start Timestamp of the partition
+    '''
+    staging = staging_table(partition_name(table, month))
+    con.execute(text(f'DROP TABLE IF EXISTS {staging}'))
+    con.execute(text(
+        f'CREATE TABLE {staging} (LIKE {table} INCLUDING DEFAULTS)'))
+
+
+def swap_partition(con, table, month):
+    '''Swap the staging table of one month in for that month's partition
+
+    The staging table is indexed first, and the old partition is detached
+    and dropped in the same transaction. Readers see either the old month
+    or the new one, and the rest of the table is left untouched.
+
+    Keyword arguments:
+    con -- sqlalchemy connection inside a transaction
+    table -- partitioned cache table (key of schema.TABLE_PARTITIONS)
+    month -- month start Timestamp of the partition
+    '''
+    partition = partition_name(table, month)
+    staging = staging_table(partition)
+    # Matching indexes are reused by ATTACH instead of built under its lock
+    create_indexes(con, table, name=staging)
+    create_partitions(con, table, {month})
+    con.execute(text(f'ALTER TABLE {table} DETACH PARTITION {partition}'))
+    con.execute(text(f'DROP TABLE {partition}'))
+    con.execute(text(f'ALTER TABLE {staging} RENAME TO {partition}'))
+    for columns in TABLE_INDEXES[table]:
+        con.execute(text(
+            f'ALTER INDEX {index_name(staging, columns)} '
+            f'RENAME TO {index_name(partition, columns)}'
+        ))
+    con.execute(text(
+        f'ALTER TABLE {table} ATTACH PARTITION {partition} FOR VALUES '
+        f"FROM ('{month:%Y-%m-%d}') "
+        f"TO ('{month + pd.offsets.MonthBegin(1):%Y-%m-%d}')"
+    ))
+
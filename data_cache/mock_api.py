@@ -0,0 +1,391 @@
+# mock_api.py
+# Local stand-in for the Shopify, Recharge and Yotpo APIs. Serves synthetic
+# paginated orders, subscriptions and point balances with Link headers,
+# leaky-bucket call limit headers, 429s and response latency, plus Shopify
+# GraphQL bulk order exports of the same orders, so ingestion can be
+# benchmarked offline (see data_cache.benchmark).
+#
+# python -m data_cache.mock_api --port 8765
+
+###########
+# IMPORTS #
+###########
+
+# Import Packages #
+import argparse
+import base64
+from datetime import datetime, timedelta, timezone
+import gzip
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import json
+import math
+import os
+import re
+import threading
+import time
+from urllib.parse import parse_qs, urlencode, urlparse
+import zlib
+from zoneinfo import ZoneInfo
+
+# Synthetic records are created evenly between these dates
+DATA_START = datetime(2019, 1, 1, tzinfo=timezone.utc)
+DATA_END = datetime(2021, 9, 1, tzinfo=timezone.utc)
+# Time zone of Shopify REST timestamps (the shop's local time, with DST)
+SHOP_ZONE = ZoneInfo(os.getenv('SHOP_TZ', 'America/New_York'))
+SUBSCRIPTION_STATUSES = ['ACTIVE', 'CANCELLED', 'EXPIRED']
+CANCELLATION_REASONS = ['Too expensive', 'Too much food', 'Moving', None]
+
+
+class LeakyBucket:
+    '''Server side call limit: capacity calls, draining leak_rate per second'''
+
+    def __init__(self, capacity, leak_rate):
+        self.capacity = capacity
+        self.leak_rate = leak_rate
+        self.level = 0
+        self.updated = time.monotonic()
+        self.lock = threading.Lock()
+
+    def take(self):
+        '''Count one call; return (accepted, used calls after it)'''
+        with self.lock:
+            now = time.monotonic()
+            self.level = max(
+                self.level - (now - self.updated) * self.leak_rate, 0)
+            self.updated = now
+            if self.level + 1 > self.capacity:
+                return False, math.ceil(self.level)
+            self.level += 1
+            return True, math.ceil(self.level)
+
+
+def encode_cursor(cursor):
+    '''Return an opaque page_info token for a cursor dictionary'''
+    return base64.urlsafe_b64encode(json.dumps(cursor).encode()).decode()
+
+
+def decode_cursor(token):
+    '''Return the cursor dictionary of a page_info token'''
+    return json.loads(base64.urlsafe_b64decode(token.encode()))
+
+
+def parse_time(value):
+    '''Parse an ISO 8601 query value; naive values are taken as UTC'''
+    parsed = datetime.fromisoformat(value.replace('Z', '+00:00'))
+    if parsed.tzinfo is None:
+        parsed = parsed.replace(tzinfo=timezone.utc)
+    return parsed
+
+
+def shop_time(value):
+    '''Format a datetime as Shopify does, in the shop's local time'''
+    return value.astimezone(SHOP_ZONE).isoformat(timespec='seconds')
+
+
+def bulk_time(value):
+    '''Format a REST timestamp as a bulk export does, in UTC (None stays None)'''
+    if value is None:
+        return None
+    return parse_time(value).astimezone(timezone.utc).strftime(
+        '%Y-%m-%dT%H:%M:%SZ')
+
+
+class MockData:
+    '''Deterministic synthetic records, created evenly over DATA_START-DATA_END
+
+    Record i is built on demand, so any number of records costs no memory
+    and created_at / updated_at filters map straight to index ranges.
+
+    Keyword arguments:
+    orders -- number of Shopify orders
+    subscriptions -- number of Recharge subscriptions
+    customers -- number of distinct customer emails
+    '''
+
+    def __init__(self, orders, subscriptions, customers):
+        self.orders = orders
+        self.subscriptions = subscriptions
+        self.customers = customers
+
+    def created_at(self, index, count):
+        return DATA_START + (DATA_END - DATA_START) * index / count
+
+    def index_range(self, count, params):
+        '''Return the [first, last) indexes matching the created/updated filters'''
+        step = (DATA_END - DATA_START) / count
+        first, last = 0, count
+        if 'created_at_min' in params:
+            since = parse_time(params['created_at_min']) - DATA_START
+            first = max(first, math.ceil(since / step))
+        if 'updated_at_min' in params:
+            # updated_at is always one day after created_at
+            since = (parse_time(params['updated_at_min'])
+                     - timedelta(days=1) - DATA_START)
+            first = max(first, math.ceil(since / step))
+        if 'created_at_max' in params:
+            until = parse_time(params['created_at_max']) - DATA_START
+            last = min(last, math.floor(until / step) + 1)
+        return max(first, 0), max(last, first, 0)
+
+    def email(self, index):
+        return f'customer{index % self.customers}@example.com'
+
+    def order(self, index):
+        created_at = self.created_at(index, self.orders)
+        skus = ['BOX-SUB-MEALS', 'ADDON-SNACKS', f'SUB-{index % 4}-PLAN']
+        return {
+            'id': 4000000000 + index,
+            'email': self.email(index),
+            'order_number': 1001 + index,
+            'created_at': shop_time(created_at),
+            'updated_at': shop_time(created_at + timedelta(days=1)),
+            'cancelled_at': (shop_time(created_at + timedelta(hours=2))
+                             if index % 10 == 0 else None),
+            'line_items': [
+                {'id': 9000000000 + index * 3 + item, 'sku': sku,
+                 'quantity': 1, 'price': '59.00', 'title': sku.title()}
+                for item, sku in enumerate(skus[:1 + index % 3])
+            ],
+        }
+
+    def bulk_order(self, index):
+        '''Return the bulk JSONL objects of an order: the order, then each
+        of its line items pointing back at it through __parentId'''
+        order = self.order(index)
+        order_id = f'gid://shopify/Order/{order["id"]}'
+        objects = [{
+            'id': order_id,
+            'email': order['email'],
+            'name': f'#{order["order_number"]}',
+            'number': order['order_number'],
+            'createdAt': bulk_time(order['created_at']),
+            'updatedAt': bulk_time(order['updated_at']),
+            'cancelledAt': bulk_time(order['cancelled_at']),
+        }]
+        for line_item in order['line_items']:
+            objects.append({
+                'id': f'gid://shopify/LineItem/{line_item["id"]}',
+                'sku': line_item['sku'],
+                '__parentId': order_id,
+            })
+        return objects
+
+    def subscription(self, index, status):
+        # Each status holds every third subscription
+        number = index * len(SUBSCRIPTION_STATUSES) + \
+            SUBSCRIPTION_STATUSES.index(status)
+        created_at = self.created_at(index, self.subscription_count())
+        created_at = created_at.replace(tzinfo=None)
+        cancelled = status == 'CANCELLED'
+        return {
+            'id': 20000000 + number,
+            'email': self.email(number),
+            'status': status,
+            'created_at': created_at.isoformat(),
+            'updated_at': (created_at + timedelta(days=1)).isoformat(),
+            'cancelled_at': ((created_at + timedelta(days=1)).isoformat()
+                             if cancelled else None),
+            'cancellation_reason': (CANCELLATION_REASONS[number % 4]
+                                    if cancelled else None),
+            'cancellation_reason_comments': 'synthetic' if cancelled else None,
+            'sku': 'BOX-SUB-MEALS',
+            'price': 59.0,
+        }
+
+    def subscription_count(self):
+        return max(self.subscriptions // len(SUBSCRIPTION_STATUSES), 1)
+
+    def balance(self, email):
+        return zlib.crc32(email.encode()) % 500
+
+
+class MockApiHandler(BaseHTTPRequestHandler):
+    '''Route requests to the Shopify, Recharge or Yotpo mock'''
+
+    protocol_version = 'HTTP/1.1'
+
+    def log_message(self, format, *args):
+        pass
+
+    def do_GET(self):
+        server = self.server
+        url = urlparse(self.path)
+        params = {name: values[0]
+                  for name, values in parse_qs(url.query).items()}
+        time.sleep(server.latency)
+
+        if url.path.startswith('/admin/api/') and url.path.endswith('/orders.json'):
+            self.paginate(url.path, params, 'orders', server.data.orders,
+                          server.data.order, server.shopify_bucket,
+                          'X-Shopify-Shop-Api-Call-Limit', 'page_info')
+        elif url.path == '/subscriptions':
+            status = params.get('status', 'ACTIVE').upper()
+            if 'cursor' in params:
+                status = decode_cursor(params['cursor'])['status']
+            self.paginate(url.path, params, 'subscriptions',
+                          server.data.subscription_count(),
+                          lambda index: server.data.subscription(index, status),
+                          server.recharge_bucket, 'X-Recharge-Limit', 'cursor',
+                          extra={'status': status})
+        elif url.path == '/api/v2/customers':
+            email = params.get('customer_email', '')
+            self.send_json({'email': email,
+                            'points_balance': server.data.balance(email)})
+        elif url.path == '/bulk/orders.jsonl':
+            first, last = int(params['first']), int(params['last'])
+            lines = (json.dumps(obj)
+                     for index in range(first, last)
+                     for obj in server.data.bulk_order(index))
+            self.send_body(''.join(f'{line}\n' for line in lines).encode(),
+                           'application/jsonl')
+        else:
+            self.send_json({'errors': 'Not Found'}, status=404)
+
+    def do_POST(self):
+        server = self.server
+        url = urlparse(self.path)
+        body = json.loads(self.rfile.read(int(self.headers['Content-Length'])))
+        time.sleep(server.latency)
+
+        if url.path.startswith('/admin/api/') and url.path.endswith('/graphql.json'):
+            self.send_json({'data': self.bulk_operation(body['query'],
+                                                        body.get('variables'))})
+        else:
+            self.send_json({'errors': 'Not Found'}, status=404)
+
+    def bulk_operation(self, query, variables):
+        '''Answer the GraphQL calls of a bulk order export
+
+        bulkOperationRunQuery starts an export of the orders matching its
+        updated_at filter, which completes at once. currentBulkOperation
+        reports it with the URL of its JSONL file.
+        '''
+        server = self.server
+        if 'bulkOperationRunQuery' in query:
+            match = re.search(r"updated_at:>='([^']+)'",
+                              (variables or {}).get('query', ''))
+            params = {'updated_at_min': match.group(1)} if match else {}
+            first, last = server.data.index_range(server.data.orders, params)
+            server.bulk = {'id': f'gid://shopify/BulkOperation/{first}-{last}',
+                           'first': first, 'last': last}
+            return {'bulkOperationRunQuery': {
+                'bulkOperation': {'id': server.bulk['id'], 'status': 'CREATED'},
+                'userErrors': [],
+            }}
+        if server.bulk is None:
+            return {'currentBulkOperation': None}
+        first, last = server.bulk['first'], server.bulk['last']
+        # Each order is followed by its 1 + index % 3 line items
+        object_count = sum(2 + index % 3 for index in range(first, last))
+        host = self.headers.get('Host')
+        return {'currentBulkOperation': {
+            'id': server.bulk['id'],
+            'status': 'COMPLETED',
+            'errorCode': None,
+            'objectCount': str(object_count),
+            'url': (f'http://{host}/bulk/orders.jsonl?'
+                    f'{urlencode({"first": first, "last": last})}'
+                    if object_count else None),
+        }}
+
+    def paginate(self, path, params, key, count, build, bucket, header,
+                 cursor_param, extra=None):
+        '''Send one page of records with call limit and Link headers'''
+        accepted, used = bucket.take()
+        limit_header = {header: f'{used}/{bucket.capacity}'}
+        if not accepted:
+            self.send_json(
+                {'errors': 'Exceeded call limit'},
+                status=429,
+                headers={**limit_header, 'Retry-After': '1.0'},
+            )
+            return
+
+        # The cursor carries the filters, like Shopify's page_info
+        if cursor_param in params:
+            cursor = decode_cursor(params[cursor_param])
+        else:
+            first, last = self.server.data.index_range(count, params)
+            cursor = {'offset': first, 'last': last, **(extra or {})}
+        limit = min(int(params.get('limit', 50)), 250)
+        start = cursor['offset']
+        end = min(start + limit, cursor['last'])
+        records = [build(index) for index in range(start, end)]
+
+        headers = dict(limit_header)
+        if end < cursor['last']:
+            next_params = {'limit': limit,
+                           cursor_param: encode_cursor({**cursor, 'offset': end})}
+            if 'fields' in params:
+                next_params['fields'] = params['fields']
+            host = self.headers.get('Host')
+            headers['Link'] = (f'<http://{host}{path}?{urlencode(next_params)}>;'
+                               f' rel="next"')
+        self.send_json({key: records}, headers=headers)
+
+    def send_json(self, body, status=200, headers=None):
+        '''Send body as JSON, gzipped when the client accepts it'''
+        self.send_body(json.dumps(body).encode(), 'application/json',
+                       status, headers)
+
+    def send_body(self, data, content_type, status=200, headers=None):
+        '''Send data, gzipped when the client accepts it'''
+        self.send_response(status)
+        if 'gzip' in self.headers.get('Accept-Encoding', ''):
+            data = gzip.compress(data, compresslevel=1)
+            self.send_header('Content-Encoding', 'gzip')
+        self.send_header('Content-Type', content_type)
+        self.send_header('Content-Length', str(len(data)))
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(data)
+
+
+def make_mock_server(port=0, orders=5000, subscriptions=6000, customers=500,
+                     latency=0.05, shopify_leak_rate=4, recharge_leak_rate=2):
+    '''Return a mock API server bound to localhost (call serve_forever)
+
+    Keyword arguments:
+    port -- port to listen on (0 picks a free one; see server_address)
+    orders -- number of synthetic Shopify orders
+    subscriptions -- number of synthetic Recharge subscriptions
+    customers -- number of distinct customer emails
+    latency -- seconds added to every response
+    shopify_leak_rate -- Shopify bucket drain per second (capacity 80)
+    recharge_leak_rate -- Recharge bucket drain per second (capacity 40)
+    '''
+    server = ThreadingHTTPServer(('127.0.0.1', port), MockApiHandler)
+    server.daemon_threads = True
+    server.data = MockData(orders, subscriptions, customers)
+    server.latency = latency
+    server.shopify_bucket = LeakyBucket(80, shopify_leak_rate)
+    server.recharge_bucket = LeakyBucket(40, recharge_leak_rate)
+    # Bounds of the last bulk order export, see MockApiHandler.bulk_operation
+    server.bulk = None
+    return server
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(
+        description='Serve mock Shopify, Recharge and Yotpo APIs')
+    parser.add_argument('--port', type=int, default=8765)
+    parser.add_argument('--orders', type=int, default=5000)
+    parser.add_argument('--subscriptions', type=int, default=6000)
+    parser.add_argument('--customers', type=int, default=500)
+    parser.add_argument('--latency', type=float, default=0.05,
+                        help='seconds added to every response')
+    parser.add_argument('--shopify-leak-rate', type=float, default=4)
+    parser.add_argument('--recharge-leak-rate', type=float, default=2)
+    args = parser.parse_args()
+    server = make_mock_server(
+        port=args.port,
+        orders=args.orders,
+        subscriptions=args.subscriptions,
+        customers=args.customers,
+        latency=args.latency,
+        shopify_leak_rate=args.shopify_leak_rate,
+        recharge_leak_rate=args.recharge_leak_rate,
+    )
+    print(f'Mock APIs on http://127.0.0.1:{server.server_address[1]}', flush=True)
+    server.serve_forever()
@@ -0,0 +1,160 @@
+# pagination.py
+# Walk cursor-paginated REST endpoints (Shopify, Recharge) one page at a time
+# so callers can process each page before the next one is requested.
+
+###########
+# IMPORTS #
+###########
+
+# Import Packages #
+from concurrent.futures import ThreadPoolExecutor
+import pandas as pd
+import queue
+import threading
+
+
+# Cursor value of a window whose last page has been processed
+PAGES_DONE = 'done'
+# Neighbouring windows are fetched this far into each other, so a record on
+# an edge is returned whether the API treats the bounds as inclusive or not,
+# or reads them in another timezone than it writes created_at in
+WINDOW_OVERLAP = pd.Timedelta(1, unit='D')
+
+
+def iter_page_cursors(session, url, key, limiter, headers=None, params=None):
+    '''Yield (records, next_url) for each page while a Next Link is present
+
+    next_url is None on the last page. Store it after a page is processed
+    and pass it back as url to resume from the following page.
+
+    Keyword arguments:
+    session -- requests session (or the requests module)
+    url -- URL of the first page, or a stored next_url to resume from
+    key -- json key holding the page records (e.g. 'orders')
+    limiter -- rate_limit.RateLimiter that paces and retries every request
+    headers -- request headers sent with every page
+    params -- query parameters for the first page only; next links
+              already carry them
+    '''
+    # Access first page of results
+    response = limiter.get(session, url, headers=headers, params=params)
+
+    # While Next Link is present, access next page
+    while True:
+        next_url = response.links.get('next', {}).get('url')
+        yield response.json()[key], next_url
+        if next_url is None:
+            return
+        response = limiter.get(session, next_url, headers=headers)
+
+
+def date_windows(start, end, shards):
+    '''Split the created_at range into shards consecutive windows
+
+    The first window has no lower bound and the last no upper bound, so
+    records outside start/end are still fetched. Returns a list of
+    (created_at_min, created_at_max) ISO 8601 pairs, None for no bound.
+
+    Keyword arguments:
+    start -- lower edge of the second window (e.g. first order date)
+    end -- upper edge of the second to last window (e.g. now)
+    shards -- number of windows
+    '''
+    edges = [edge.floor('s').isoformat()
+             for edge in pd.date_range(start, end, periods=shards + 1)]
+    edges[0] = None
+    edges[-1] = None
+    return list(zip(edges[:-1], edges[1:]))
+
+
+def window_time(value):
+    '''Return a created_at value or window edge as a naive UTC Timestamp
+
+    Keyword arguments:
+    value -- Timestamp or ISO 8601 string, with or without an offset
+    '''
+    stamp = pd.Timestamp(value)
+    if stamp.tzinfo is not None:
+        stamp = stamp.tz_convert('UTC').tz_localize(None)
+    return stamp
+
+
+def iter_sharded_pages(fetch_window, windows, cursors=None):
+    '''Walk the pages of every window in parallel and yield them as they come
+
+    Each window's cursor chain runs in its own worker thread. Pages pass
+    through a bounded queue, so memory stays at a few pages per worker.
+    Yields (window index, records, next_url) so callers can checkpoint
+    every window's cursor.
+
+    Each window is fetched WINDOW_OVERLAP beyond its edges. It only keeps
+    the records created at or after its lower edge and before its upper
+    edge, so every record belongs to exactly one window, also across
+    resumed runs.
+
+    Keyword arguments:
+    fetch_window -- callable(created_at_min, created_at_max, page_url)
+                    returning a (records, next_url) generator that starts at
+                    page_url when given; share one limiter between the calls
+    windows -- list of (created_at_min, created_at_max) from date_windows
+    cursors -- per window None (start), a next_url to resume from, or
+               PAGES_DONE to skip the window (default start every window)
+    '''
+    if cursors is None:
+        cursors = [None] * len(windows)
+    pages = queue.Queue(maxsize=2 * len(windows))
+    stop = threading.Event()
+
+    def put(item):
+        while not stop.is_set():
+            try:
+                pages.put(item, timeout=1)
+                return
+            except queue.Full:
+                continue
+
+    def padded(edge, offset):
+        return None if edge is None else (pd.Timestamp(edge)
+                                          + offset).isoformat()
+
+    def walk(index):
+        created_at_min, created_at_max = windows[index]
+        lower = None if created_at_min is None else window_time(created_at_min)
+        upper = None if created_at_max is None else window_time(created_at_max)
+        try:
+            if cursors[index] == PAGES_DONE:
+                return
+            for records, next_url in fetch_window(
+                    padded(created_at_min, -WINDOW_OVERLAP),
+                    padded(created_at_max, WINDOW_OVERLAP),
+                    cursors[index]):
+                if stop.is_set():
+                    return
+                records = [
+                    record for record in records
+                    if (lower is None
+                        or window_time(record['created_at']) >= lower)
+                    and (upper is None
+                         or window_time(record['created_at']) < upper)
+                ]
+                put(('page', (index, records, next_url)))
+        except Exception as error:
+            put(('error', error))
+        finally:
+            put(('done', None))
+
+    with ThreadPoolExecutor(max_workers=len(windows)) as executor:
+        for index in range(len(windows)):
+            executor.submit(walk, index)
+        try:
+            remaining = len(windows)
+            while remaining:
+                kind, value = pages.get()
+                if kind == 'done':
+                    remaining -= 1
+                elif kind == 'error':
+                    raise value
+                else:
+                    yield value
+        finally:
+            stop.set()
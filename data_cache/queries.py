@@ -0,0 +1,44 @@
+# queries.py
+# Parameterized queries the Dash pages run per callback, so filtering
+# happens in PostgreSQL on indexed columns instead of on a DataFrame of the
+# whole table loaded at import.
+
+###########
+# IMPORTS #
+###########
+
+# Import local modules #
+from data_cache.db import read_sql
+from data_cache.dtypes import compact_frame
+
+# Columns of cancel_db shown on the Cancellations page
+CANCEL_COLUMNS = ['email', 'cancelled_at', 'cancellation_reason',
+                  'cancellation_reason_comments', 'yotpo_point_balance']
+
+
+def fetch_cancellations(start_date, end_date, reason=None, with_comments=False):
+    '''Return the cancellations between two dates, newest first
+
+    Uses the cancel_db indexes on cancelled_at and cancellation_reason.
+
+    Keyword arguments:
+    start_date -- only cancellations after this date ('YYYY-MM-DD')
+    end_date -- only cancellations before this date ('YYYY-MM-DD')
+    reason -- only this cancellation reason (default all reasons)
+    with_comments -- only cancellations with a non-empty comment
+    '''
+    conditions = ['cancelled_at > :start_date',
+                  'cancelled_at < :end_date']
+    if reason is not None:
+        conditions.append('cancellation_reason = :reason')
+    if with_comments:
+        conditions.append("cancellation_reason_comments <> ''")
+    query = f"""SELECT {', '.join(CANCEL_COLUMNS)}
+                FROM cancel_db
+                WHERE {' AND '.join(conditions)}
+                ORDER BY cancelled_at DESC
+                """
+    df_cancel = read_sql(query, {'start_date': start_date,
+                                 'end_date': end_date,
+                                 'reason': reason})
+    return compact_frame(df_cancel, 'cancel_db')
@@ -0,0 +1,230 @@
+# rate_limit.py
+# Pace API requests so concurrent fetchers stay inside a request budget,
+# and retry requests the API rejected for rate limit or server errors.
+
+###########
+# IMPORTS #
+###########
+
+# Import Packages #
+import threading
+import time
+
+# Status codes worth retrying: rate limited or a transient server error
+RETRY_STATUS = {429, 500, 502, 503, 504}
+
+
+class RateLimiter:
+    '''Thread-safe limiter that spaces requests evenly over time
+
+    Every call to wait() reserves the next free slot and sleeps until it
+    arrives, so any number of threads sharing one limiter stay within
+    requests_per_second combined. request() sends a request through the
+    limiter and retries 429 and 5xx responses with exponential backoff,
+    honouring Retry-After when the API sends it.
+
+    Keyword arguments:
+    requests_per_second -- request budget shared by all callers
+    max_retries -- retries of one request before its error is raised
+    backoff -- seconds to wait before the first retry; doubles every retry
+
+    slept and retries count the seconds callers were held back and the
+    requests that were retried, for benchmarks and run summaries.
+    last_call() returns the timings of the calling thread's last request().
+    '''
+
+    def __init__(self, requests_per_second, max_retries=5, backoff=1):
+        self.interval = 1 / requests_per_second
+        self.next_slot = time.monotonic()
+        self.max_retries = max_retries
+        self.backoff = backoff
+        self.lock = threading.Lock()
+        self.slept = 0
+        self.retries = 0
+        self.calls = threading.local()
+
+    def wait(self):
+        '''Block until the caller may send its next request'''
+        with self.lock:
+            now = time.monotonic()
+            slot = max(self.next_slot, now)
+            self.next_slot = slot + self.interval
+            delay = slot - now
+            self.slept += delay
+        if delay > 0:
+            time.sleep(delay)
+        return delay
+
+    def update(self, response):
+        '''Learn from the response of a request (no-op for a fixed budget)'''
+
+    def penalize(self, delay):
+        '''Hold back every caller for delay seconds after a rejection'''
+        with self.lock:
+            self.next_slot = max(self.next_slot, time.monotonic() + delay)
+
+    def last_call(self):
+        '''Return (request seconds, wait seconds) of the calling thread's
+        last request()
+
+        Request seconds cover only the HTTP calls, including retried ones.
+        Wait seconds are the time spent queued for the request budget.
+        '''
+        return (getattr(self.calls, 'request_seconds', 0),
+                getattr(self.calls, 'wait_seconds', 0))
+
+    def request(self, session, method, url, **kwargs):
+        '''Send a request within the budget, retrying rejections
+
+        Keyword arguments:
+        session -- requests session (or the requests module)
+        method -- HTTP method ('GET', 'POST', ...)
+        url -- URL to request
+        kwargs -- passed on to session.request (headers, params, json, ...)
+        '''
+        self.calls.request_seconds = self.calls.wait_seconds = 0
+        for attempt in range(self.max_retries + 1):
+            started = time.perf_counter()
+            self.wait()
+            sent = time.perf_counter()
+            try:
+                response = session.request(method, url, **kwargs)
+            finally:
+                self.calls.wait_seconds += sent - started
+                self.calls.request_seconds += time.perf_counter() - sent
+            self.update(response)
+            if (response.status_code not in RETRY_STATUS
+                    or attempt == self.max_retries):
+                break
+            delay = retry_after(response)
+            if delay is None:
+                delay = self.backoff * 2 ** attempt
+            print(f'{response.status_code} from {url}, '
+                  f'retrying in {delay:.1f}s')
+            with self.lock:
+                self.retries += 1
+            self.penalize(delay)
+        response.raise_for_status()
+        return response
+
+    def get(self, session, url, **kwargs):
+        '''Send a GET request within the budget (see request)'''
+        return self.request(session, 'GET', url, **kwargs)
+
+    def post(self, session, url, **kwargs):
+        '''Send a POST request within the budget (see request)'''
+        return self.request(session, 'POST', url, **kwargs)
+
+
+class BucketRateLimiter(RateLimiter):
+    '''Limiter that models a leaky-bucket API call limit
+
+    The bucket fills by one per request and drains at leak_rate per second.
+    The used/capacity numbers of the limit header on every response keep
+    the model in line with the server, and requests are paced so the
+    bucket stays headroom calls below capacity.
+
+    Keyword arguments:
+    header -- response header holding 'used/capacity'
+    leak_rate -- calls per second the API drains from the bucket
+    capacity -- bucket size until the first response reports it
+    headroom -- calls kept free for other clients of the same API
+    max_retries -- retries of one request before its error is raised
+    backoff -- seconds to wait before the first retry; doubles every retry
+    '''
+
+    def __init__(self, header, leak_rate, capacity, headroom=2,
+                 max_retries=5, backoff=1):
+        super().__init__(leak_rate, max_retries=max_retries, backoff=backoff)
+        self.header = header
+        self.leak_rate = leak_rate
+        self.capacity = capacity
+        self.headroom = headroom
+        self.level = 0
+        self.updated = time.monotonic()
+
+    def drain(self, now):
+        '''Return the modelled bucket level at now (lock must be held)'''
+        return max(self.level - (now - self.updated) * self.leak_rate, 0)
+
+    def wait(self):
+        '''Block until the bucket has room for one more request'''
+        with self.lock:
+            now = time.monotonic()
+            level = self.drain(now)
+            limit = self.capacity - self.headroom
+            delay = max((level + 1 - limit) / self.leak_rate, 0)
+            # Reserve the call now so concurrent callers queue behind it
+            self.level = level + 1
+            self.updated = now
+            self.slept += delay
+        if delay > 0:
+            time.sleep(delay)
+        return delay
+
+    def update(self, response):
+        '''Sync the bucket model with the limit header of a response'''
+        used_capacity = parse_call_limit(response.headers.get(self.header))
+        with self.lock:
+            now = time.monotonic()
+            level = self.drain(now)
+            if used_capacity is not None:
+                used, self.capacity = used_capacity
+                level = max(level, used)
+            if response.status_code == 429:
+                level = max(level, self.capacity)
+            self.level = level
+            self.updated = now
+
+    def penalize(self, delay):
+        '''Treat the bucket as full until delay seconds from now, when the
+        next request may go out'''
+        with self.lock:
+            now = time.monotonic()
+            self.level = max(self.drain(now),
+                             self.capacity - self.headroom - 1
+                             + delay * self.leak_rate)
+            self.updated = now
+
+
+def parse_call_limit(value):
+    '''Return (used, capacity) from a '39/40' style header, or None
+
+    Keyword arguments:
+    value -- header value
+    '''
+    try:
+        used, capacity = value.split('/')
+        return float(used), float(capacity)
+    except (AttributeError, ValueError):
+        return None
+
+
+def retry_after(response):
+    '''Return the Retry-After header in seconds, or None if absent
+
+    Keyword arguments:
+    response -- requests response
+    '''
+    try:
+        return max(float(response.headers['Retry-After']), 0)
+    except (KeyError, ValueError):
+        return None
+
+
+def shopify_limiter():
+    '''Limiter for the Shopify Admin REST API (Plus: 80 calls, 4/s leak)'''
+    return BucketRateLimiter(
+        header='X-Shopify-Shop-Api-Call-Limit',
+        leak_rate=4,
+        capacity=80,
+    )
+
+
+def recharge_limiter():
+    '''Limiter for the Recharge API (40 calls, 2/s leak)'''
+    return BucketRateLimiter(
+        header='X-Recharge-Limit',
+        leak_rate=2,
+        capacity=40,
+    )
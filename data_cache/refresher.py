@@ -0,0 +1,122 @@
+# refresher.py
+# Keep the datasets of the Dash pages current without restarting the
+# server. A background thread in every worker polls a version of each
+# dataset and, when it changes, rebuilds the page's derived frames off the
+# request path and swaps them in with a single assignment.
+
+###########
+# IMPORTS #
+###########
+
+# Import Packages #
+import os
+import threading
+import time
+import traceback
+
+# Import .env variables #
+from dotenv import load_dotenv
+load_dotenv()  # take environment variables from .env
+# Seconds between version checks of the registered datasets
+REFRESH_SECONDS = float(os.getenv('REFRESH_SECONDS', 60))
+
+# name -> (version, build) callables of each registered dataset
+_datasets = {}
+# name -> version the current value was built at
+_versions = {}
+# name -> built value. Replaced as a whole, never changed in place, so a
+# reader sees either the old or the new value of every dataset.
+_current = {}
+_thread_pid = None
+_thread_lock = threading.Lock()
+
+
+def register(name, build, version, built_version=None):
+    '''Build a dataset now and keep it current from then on
+
+    Keyword arguments:
+    name -- dataset name passed to current()
+    build -- function returning the value (e.g. a dict of DataFrames)
+    version -- function returning a token that changes with the source data
+    built_version -- function returning the version of what build() read,
+                     if it can tell without the checks version() makes
+                     (default version)
+    '''
+    global _current
+    _datasets[name] = (version, build)
+    # Read before building, so a change in between is picked up later
+    _versions[name] = (built_version or version)()
+    _current = {**_current, name: build()}
+
+
+def current(name):
+    '''Return the latest built value of a registered dataset
+
+    Never waits for a rebuild. Read it once per callback and use that value
+    throughout, so every frame of one response comes from the same build.
+    The value is only kept current once start_refresher() ran in this
+    process.
+
+    Keyword arguments:
+    name -- dataset name given to register()
+    '''
+    return _current[name]
+
+
+def refresh(name):
+    '''Rebuild a dataset if its version changed; return True if it did
+
+    Keyword arguments:
+    name -- dataset name given to register()
+    '''
+    global _current
+    version, build = _datasets[name]
+    new_version = version()
+    if new_version == _versions.get(name):
+        return False
+    value = build()
+    _current = {**_current, name: value}
+    _versions[name] = new_version
+    print(f'refresher: rebuilt {name} (version {new_version})')
+    return True
+
+
+def refresh_all():
+    '''Check every registered dataset once
+
+    A dataset that fails to rebuild keeps serving its last value and is
+    tried again on the next check.
+    '''
+    for name in list(_datasets):
+        try:
+            refresh(name)
+        except Exception:
+            print(f'refresher: {name} failed to refresh')
+            traceback.print_exc()
+
+
+def _run(interval):
+    while True:
+        time.sleep(interval)
+        refresh_all()
+
+
+def start_refresher(interval=REFRESH_SECONDS):
+    '''Start the refresh thread of this process if it is not running
+
+    Threads do not survive a fork, and a fork taken while the thread holds
+    a lock leaves that lock held in the child. Under gunicorn --preload it
+    is therefore started in each worker by the post_fork hook in
+    gunicorn.conf.py, never in the master.
+
+    Keyword arguments:
+    interval -- seconds between version checks
+    '''
+    global _thread_pid
+    if _thread_pid == os.getpid():
+        return
+    with _thread_lock:
+        if _thread_pid != os.getpid():
+            threading.Thread(target=_run, args=(interval,),
+                             name='dataset-refresher', daemon=True).start()
+            _thread_pid = os.getpid()
@@ -0,0 +1,170 @@
+# rollups.py
+# Pre-aggregated tables the Dash pages read instead of grouping the full
+# cache tables in every worker. Each rollup is refreshed in the transaction
+# of the sync that changed its source rows, for the affected rows only.
+
+###########
+# IMPORTS #
+###########
+
+# Import Packages #
+from sqlalchemy import text
+
+# Monthly cancellation counts per reason (pages/cancellations2.py)
+CANCEL_ROLLUP_TABLE = 'cancel_monthly_reason'
+
+
+def cancel_months(df_cancel):
+    '''Return the set of cancelled_at month starts in a cancellation DataFrame
+
+    Keyword arguments:
+    df_cancel -- DataFrame from update_cancel_table.generate_dataframe
+    '''
+    months = df_cancel['cancelled_at'].dropna().dt.to_period('M').dt.start_time
+    return {month.to_pydatetime() for month in months}
+
+
+def refresh_cancel_rollup(con, months=None):
+    '''Recompute cancel_monthly_reason from cancel_db
+
+    Rows are counted per cancelled_at month and cancellation reason, with
+    the month total and each reason's share of it. Only the given months
+    are replaced; the whole table is rebuilt when months is None or the
+    table is still empty.
+
+    Keyword arguments:
+    con -- sqlalchemy connection inside the transaction that changed cancel_db
+    months -- iterable of month start datetimes to refresh (default all)
+    '''
+    if months is not None:
+        has_rows = con.execute(text(
+            f'SELECT EXISTS (SELECT 1 FROM {CANCEL_ROLLUP_TABLE})')).scalar()
+        if not has_rows:
+            months = None
+    params = {'all_months': months is None, 'months': list(months or [])}
+    if months is not None and not params['months']:
+        return
+
+    con.execute(
+        text(f'''
+            DELETE FROM {CANCEL_ROLLUP_TABLE}
+            WHERE :all_months OR cancelled_at = ANY(:months)
+        '''),
+        params,
+    )
+    con.execute(
+        text(f'''
+            INSERT INTO {CANCEL_ROLLUP_TABLE} (
+                cancelled_at, cancellation_reason, cancel_count,
+                month_cancel_total, percent_total
+            )
+            SELECT
+                month,
+                cancellation_reason,
+                cancel_count,
+                month_cancel_total,
+                cancel_count::float / NULLIF(month_cancel_total, 0)
+            FROM (
+                SELECT
+                    date_trunc('month', cancelled_at) AS month,
+                    cancellation_reason,
+                    count(email) AS cancel_count,
+                    sum(count(email)) OVER (
+                        PARTITION BY date_trunc('month', cancelled_at)
+                    ) AS month_cancel_total
+                FROM cancel_db
+                WHERE cancelled_at IS NOT NULL
+                  AND (:all_months
+                       OR date_trunc('month', cancelled_at) = ANY(:months))
+                GROUP BY 1, 2
+            ) counts
+        '''),
+        params,
+    )
+
+
+# Per-customer first order week and order count (source of the cohorts)
+RETENTION_CUSTOMER_TABLE = 'retention_customer'
+# Weekly order retention cohorts (pages/retention_order.py)
+RETENTION_COHORT_TABLE = 'retention_weekly_cohort'
+# Cohorts count customers reaching 2 up to this many subscription orders
+RETENTION_MAX_ORDERS = 10
+
+# Week label of a first order: the Monday of its Monday-to-Sunday week.
+# Matches the page's original pandas grouping (created_at shifted back
+# 6 days, then W-MON bins).
+FIRST_ORDER_WEEK_SQL = "date_trunc('week', min(created_at))"
+
+
+def refresh_retention(con, emails=None):
+    '''Recompute retention cohorts from active_sub
+
+    The first order week and order count of the given customers are
+    recomputed, then only the cohorts those customers left or joined.
+    Everything is rebuilt when emails is None or the cohort table is
+    still empty.
+
+    Keyword arguments:
+    con -- sqlalchemy connection inside the transaction that changed active_sub
+    emails -- iterable of customer emails with changed orders (default all)
+    '''
+    if emails is not None:
+        has_rows = con.execute(text(
+            f'SELECT EXISTS (SELECT 1 FROM {RETENTION_COHORT_TABLE})')).scalar()
+        if not has_rows:
+            emails = None
+    params = {'all_emails': emails is None,
+              'emails': [email for email in (emails or []) if email is not None]}
+    if emails is not None and not params['emails']:
+        return
+
+    # Replace the customers and remember the weeks they were and are in
+    old_weeks = con.execute(
+        text(f'''
+            DELETE FROM {RETENTION_CUSTOMER_TABLE}
+            WHERE :all_emails OR email = ANY(:emails)
+            RETURNING first_order_week
+        '''),
+        params,
+    ).scalars().all()
+    new_weeks = con.execute(
+        text(f'''
+            INSERT INTO {RETENTION_CUSTOMER_TABLE}
+                (email, first_order_week, order_count)
+            SELECT email, {FIRST_ORDER_WEEK_SQL}, count(order_number)
+            FROM active_sub
+            WHERE email IS NOT NULL
+              AND (:all_emails OR email = ANY(:emails))
+            GROUP BY email
+            RETURNING first_order_week
+        '''),
+        params,
+    ).scalars().all()
+
+    # Recount the affected cohorts
+    order_counts = ',\n'.join(
+        f'count(*) FILTER (WHERE order_count >= {number})'
+        for number in range(2, RETENTION_MAX_ORDERS + 1)
+    )
+    order_columns = ', '.join(
+        f'orders_{number}' for number in range(2, RETENTION_MAX_ORDERS + 1))
+    weeks = {'all_weeks': emails is None,
+             'weeks': list(set(old_weeks) | set(new_weeks))}
+    con.execute(
+        text(f'''
+            DELETE FROM {RETENTION_COHORT_TABLE}
+            WHERE :all_weeks OR first_order_week = ANY(:weeks)
+        '''),
+        weeks,
+    )
+    con.execute(
+        text(f'''
+            INSERT INTO {RETENTION_COHORT_TABLE}
+                (first_order_week, customers, {order_columns})
+            SELECT first_order_week, count(*), {order_counts}
+            FROM {RETENTION_CUSTOMER_TABLE}
+            WHERE :all_weeks OR first_order_week = ANY(:weeks)
+            GROUP BY first_order_week
+        '''),
+        weeks,
+    )
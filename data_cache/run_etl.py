@@ -0,0 +1,163 @@
+# run_etl.py
+# Run every data cache job from one entry point: the Recharge and Shopify
+# syncs, then the jobs that depend on them, in dependency order. Jobs whose
+# inputs did not change are skipped, and each run's stage durations are
+# stored in etl_state.
+
+###########
+# IMPORTS #
+###########
+
+# Import Packages #
+import argparse
+import json
+import sys
+import time
+import traceback
+from graphlib import TopologicalSorter
+
+# Import local modules #
+from data_cache.db import get_engine
+from data_cache.etl_state import ensure_state_table, set_state
+from data_cache.snapshots import refresh_snapshot
+from data_cache.update_active_table import sync_active_orders
+from data_cache.update_cancel_table import (sync_cancellations,
+                                            update_yotpo_balances)
+
+# State key holding the stage results and durations of the last run
+LAST_RUN_KEY = 'etl.last_run'
+
+##########
+# Stages #
+##########
+
+# Each stage runs after the stages in 'after'. A 'when_changed' stage only
+# runs when one of them loaded new data. 'run' takes the engine and the
+# parsed arguments, and returns a truthy value when it changed data, or
+# None when it cannot tell.
+STAGES = {
+    'cancel_db': {
+        'after': [],
+        'when_changed': False,
+        'run': lambda engine, args: sync_cancellations(
+            engine, full=args.full, shards=args.shards),
+    },
+    'yotpo_balances': {
+        # Balances change in Yotpo, so they are refreshed on every run
+        'after': ['cancel_db'],
+        'when_changed': False,
+        'run': lambda engine, args: update_yotpo_balances(engine),
+    },
+    'cancel_snapshot': {
+        'after': ['cancel_db'],
+        'when_changed': True,
+        'run': lambda engine, args: refresh_snapshot('cancel_monthly_reason'),
+    },
+    'active_sub': {
+        'after': [],
+        'when_changed': False,
+        'run': lambda engine, args: sync_active_orders(
+            engine, full=args.full, source=args.source, shards=args.shards),
+    },
+    'retention_snapshot': {
+        'after': ['active_sub'],
+        'when_changed': True,
+        'run': lambda engine, args: refresh_snapshot('retention_weekly_cohort'),
+    },
+}
+
+
+def stage_order(stages):
+    '''Return the stage names in an order that runs every stage after the
+    stages it depends on
+
+    Keyword arguments:
+    stages -- dictionary of stages like STAGES
+    '''
+    return list(TopologicalSorter(
+        {name: stage['after'] for name, stage in stages.items()}
+    ).static_order())
+
+
+def run_stages(engine, args, stages=STAGES):
+    '''Run the stages in dependency order and return their results
+
+    A stage is skipped when a stage it depends on failed, or when it only
+    runs on changes and none of those stages changed anything. A failed
+    stage does not stop stages that do not depend on it.
+
+    Keyword arguments:
+    engine -- sqlalchemy engine
+    args -- parsed command line arguments passed to every stage
+    stages -- dictionary of stages (default STAGES)
+    '''
+    results = {}
+    for name in stage_order(stages):
+        stage = stages[name]
+        upstream = [results[after]['status'] for after in stage['after']]
+        if 'failed' in upstream or 'skipped' in upstream:
+            results[name] = {'status': 'skipped', 'seconds': 0}
+            print(f'etl: {name} skipped, an upstream stage did not run')
+            continue
+        if stage['when_changed'] and 'changed' not in upstream:
+            results[name] = {'status': 'unchanged', 'seconds': 0}
+            print(f'etl: {name} skipped, its inputs are unchanged')
+            continue
+
+        started = time.perf_counter()
+        try:
+            changed = stage['run'](engine, args)
+        except Exception:
+            status = 'failed'
+            traceback.print_exc()
+        else:
+            status = 'unchanged' if changed is not None and not changed \
+                else 'changed'
+        seconds = round(time.perf_counter() - started, 2)
+        results[name] = {'status': status, 'seconds': seconds}
+        print(f'etl: {name} {status} in {seconds}s')
+    return results
+
+
+def record_run(engine, results):
+    '''Store the stage results of a run under LAST_RUN_KEY
+
+    Keyword arguments:
+    engine -- sqlalchemy engine
+    results -- dictionary returned by run_stages
+    '''
+    ensure_state_table(engine)
+    with engine.begin() as con:
+        set_state(con, LAST_RUN_KEY, json.dumps(results))
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(
+        description='Run the data cache jobs in dependency order')
+    parser.add_argument(
+        '--full',
+        action='store_true',
+        help='ignore stored watermarks and rebuild cancel_db and active_sub',
+    )
+    parser.add_argument(
+        '--source',
+        choices=['rest', 'bulk'],
+        default='rest',
+        help='page the REST Order API or run a GraphQL bulk operation',
+    )
+    parser.add_argument(
+        '--shards',
+        type=int,
+        default=1,
+        help='walk this many created_at windows of each API in parallel',
+    )
+    args = parser.parse_args()
+    engine = get_engine()
+    started = time.perf_counter()
+    results = run_stages(engine, args)
+    record_run(engine, results)
+    print(f'etl: finished in {time.perf_counter() - started:.2f}s')
+    for name, result in results.items():
+        print(f'  {name:<20} {result["status"]:<10} {result["seconds"]:>8}s')
+    if any(result['status'] == 'failed' for result in results.values()):
+        sys.exit(1)
@@ -0,0 +1,238 @@
+# schema.py
+# Explicit column types and indexes of the cache tables read by the Dash
+# app, instead of the text columns pandas.to_sql infers.
+
+###########
+# IMPORTS #
+###########
+
+# Import Packages #
+import pandas as pd
+from sqlalchemy import text
+
+# Column definitions of each cache table
+TABLE_COLUMNS = {
+    'cancel_db': [
+        ('email', 'TEXT'),
+        ('cancelled_at', 'TIMESTAMP'),
+        ('cancellation_reason', 'TEXT'),
+        ('cancellation_reason_comments', 'TEXT'),
+        ('yotpo_point_balance', 'INTEGER NOT NULL DEFAULT 0'),
+        ('subscription_id', 'BIGINT'),
+    ],
+    'active_sub': [
+        ('email', 'TEXT'),
+        ('order_number', 'BIGINT'),
+        ('created_at', 'TIMESTAMP'),
+        ('sku', 'TEXT'),
+        ('cancelled_at', 'TIMESTAMP'),
+    ],
+    'cancel_monthly_reason': [
+        ('cancelled_at', 'TIMESTAMP NOT NULL'),
+        ('cancellation_reason', 'TEXT'),
+        ('cancel_count', 'INTEGER NOT NULL'),
+        ('month_cancel_total', 'INTEGER NOT NULL'),
+        ('percent_total', 'DOUBLE PRECISION'),
+    ],
+    'retention_customer': [
+        ('email', 'TEXT PRIMARY KEY'),
+        ('first_order_week', 'TIMESTAMP NOT NULL'),
+        ('order_count', 'INTEGER NOT NULL'),
+    ],
+    'retention_weekly_cohort': [
+        ('first_order_week', 'TIMESTAMP PRIMARY KEY'),
+        ('customers', 'INTEGER NOT NULL'),
+        ('orders_2', 'INTEGER NOT NULL'),
+        ('orders_3', 'INTEGER NOT NULL'),
+        ('orders_4', 'INTEGER NOT NULL'),
+        ('orders_5', 'INTEGER NOT NULL'),
+        ('orders_6', 'INTEGER NOT NULL'),
+        ('orders_7', 'INTEGER NOT NULL'),
+        ('orders_8', 'INTEGER NOT NULL'),
+        ('orders_9', 'INTEGER NOT NULL'),
+        ('orders_10', 'INTEGER NOT NULL'),
+    ],
+}
+
+# B-tree indexes of each cache table, as column tuples
+TABLE_INDEXES = {
+    'cancel_db': [
+        ('cancelled_at',),
+        ('cancellation_reason',),
+        ('subscription_id',),
+    ],
+    'active_sub': [
+        ('email', 'created_at'),
+        ('order_number',),
+    ],
+    'cancel_monthly_reason': [
+        ('cancelled_at',),
+    ],
+    'retention_customer': [
+        ('first_order_week',),
+    ],
+    'retention_weekly_cohort': [],
+}
+
+# Tables split into monthly range partitions, and their partition column.
+# Rows with a NULL partition column go to the table's default partition.
+TABLE_PARTITIONS = {
+    'cancel_db': 'cancelled_at',
+    'active_sub': 'created_at',
+}
+
+
+def index_name(table, columns):
+    '''Return the name of the index on columns of table'''
+    return f'{table}_{"_".join(columns)}_idx'
+
+
+def partition_name(table, month):
+    '''Return the name of the partition of table holding month'''
+    return f'{table}_p{month:%Y%m}'
+
+
+def partition_month(stamp):
+    '''Return the start of the partition month of a timestamp
+
+    Timestamps with an offset are taken at their wall time, as PostgreSQL
+    does when it stores them in a TIMESTAMP column.
+
+    Keyword arguments:
+    stamp -- Timestamp, datetime or ISO 8601 string
+    '''
+    return pd.Timestamp(stamp).replace(tzinfo=None).to_period('M').start_time
+
+
+def partition_months(df, table):
+    '''Return the partition month starts of the rows of df
+
+    Keyword arguments:
+    df -- DataFrame of rows of a partitioned cache table
+    table -- cache table (key of TABLE_PARTITIONS)
+    '''
+    column = TABLE_PARTITIONS[table]
+    if column not in df.columns:
+        return set()
+    return {partition_month(stamp) for stamp in pd.unique(df[column].dropna())}
+
+
+def is_partitioned(con, name):
+    '''Return True if the table name is a partitioned table
+
+    Tables created before partitioning stay plain tables until the next full
+    sync rebuilds them.
+
+    Keyword arguments:
+    con -- sqlalchemy connection
+    name -- table name
+    '''
+    relkind = con.execute(
+        text('SELECT relkind FROM pg_class WHERE oid = to_regclass(:name)'),
+        {'name': name},
+    ).scalar()
+    return relkind == 'p'
+
+
+def create_partitions(con, table, months, name=None):
+    '''Create the monthly partitions of a cache table if they do not exist
+
+    Create them before rows of a new month are written, so the rows are
+    not routed to the default partition.
+
+    Keyword arguments:
+    con -- sqlalchemy connection inside a transaction
+    table -- cache table (key of TABLE_PARTITIONS)
+    months -- month start Timestamps
+    name -- name of the partitioned table (default table)
+    '''
+    name = name or table
+    if not months or not is_partitioned(con, name):
+        return
+    for month in sorted(months):
+        con.execute(text(
+            f'CREATE TABLE IF NOT EXISTS {partition_name(name, month)} '
+            f'PARTITION OF {name} FOR VALUES '
+            f"FROM ('{month:%Y-%m-%d}') "
+            f"TO ('{month + pd.offsets.MonthBegin(1):%Y-%m-%d}')"
+        ))
+
+
+def create_table(con, table, name=None):
+    '''Create a cache table from its column definitions if it does not exist
+
+    Tables in TABLE_PARTITIONS are created partitioned by month, with only
+    their default partition. Monthly partitions are added as rows arrive.
+
+    Keyword arguments:
+    con -- sqlalchemy connection inside a transaction
+    table -- cache table whose columns to use (key of TABLE_COLUMNS)
+    name -- name of the created table (default table, e.g. a staging table)
+    '''
+    name = name or table
+    columns = ',\n'.join(f'{column} {column_type}'
+                         for column, column_type in TABLE_COLUMNS[table])
+    partition_by = ''
+    if table in TABLE_PARTITIONS:
+        partition_by = f' PARTITION BY RANGE ({TABLE_PARTITIONS[table]})'
+    con.execute(text(
+        f'CREATE TABLE IF NOT EXISTS {name} (\n{columns}\n){partition_by}'))
+    if table in TABLE_PARTITIONS and is_partitioned(con, name):
+        con.execute(text(
+            f'CREATE TABLE IF NOT EXISTS {name}_default '
+            f'PARTITION OF {name} DEFAULT'))
+
+
+def create_indexes(con, table, name=None):
+    '''Create the indexes of a cache table if they do not exist
+
+    Indexes of a partitioned table are created on every partition.
+
+    Keyword arguments:
+    con -- sqlalchemy connection inside a transaction
+    table -- cache table whose indexes to use (key of TABLE_INDEXES)
+    name -- name of the indexed table (default table)
+    '''
+    name = name or table
+    for columns in TABLE_INDEXES[table]:
+        con.execute(text(
+            f'CREATE INDEX IF NOT EXISTS {index_name(name, columns)} '
+            f'ON {name} ({", ".join(columns)})'
+        ))
+
+
+def add_missing_columns(con, table):
+    '''Add the columns of a cache table that an existing table lacks
+
+    Constraints other than a DEFAULT are left out, since existing rows
+    have no values for the new column.
+
+    Keyword arguments:
+    con -- sqlalchemy connection inside a transaction
+    table -- cache table (key of TABLE_COLUMNS)
+    '''
+    for column, column_type in TABLE_COLUMNS[table]:
+        definition = column_type.split()[0]
+        if 'DEFAULT' in column_type:
+            definition = column_type.replace('PRIMARY KEY', '').strip()
+        elif column_type.startswith('DOUBLE PRECISION'):
+            definition = 'DOUBLE PRECISION'
+        con.execute(text(
+            f'ALTER TABLE {table} ADD COLUMN IF NOT EXISTS {column} {definition}'))
+
+
+def ensure_schema(engine, table):
+    '''Create a cache table and its indexes if they are missing
+
+    Tables left by older to_sql loads keep their column types until the
+    next full sync rebuilds them. Columns they lack (e.g. subscription_id)
+    are added first, so they get the indexes straight away.
+
+    Keyword arguments:
+    engine -- sqlalchemy engine
+    table -- cache table (key of TABLE_COLUMNS)
+    '''
+    with engine.begin() as con:
+        create_table(con, table)
+        add_missing_columns(con, table)
+        create_indexes(con, table)
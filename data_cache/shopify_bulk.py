@@ -0,0 +1,237 @@
+# shopify_bulk.py
+# Export Shopify orders with a GraphQL bulk operation and stream the
+# resulting JSONL file, instead of paging the REST Order API 250 at a time.
+
+###########
+# IMPORTS #
+###########
+
+# Import Packages #
+from dotenv import load_dotenv
+import json
+import os
+import pandas as pd
+import time
+
+# Import local modules #
+from data_cache.config import SHOPIFY_API_URL
+from data_cache.dtypes import SHOP_TZ
+from data_cache.http_client import shared_session
+from data_cache.rate_limit import RateLimiter
+
+# Import .env variables #
+load_dotenv()  # take environment variables from .env
+SHOPIFY_PASSWORD = os.getenv('SHOPIFY_PASSWORD')
+
+GRAPHQL_URL = f'{SHOPIFY_API_URL}/admin/api/2021-07/graphql.json'
+# Seconds between bulk operation status checks
+POLL_INTERVAL = 5
+
+ORDER_BULK_QUERY = '''
+{
+  orders%s {
+    edges {
+      node {
+        id
+        email
+        number
+        createdAt
+        updatedAt
+        cancelledAt
+        lineItems {
+          edges {
+            node {
+              id
+              sku
+            }
+          }
+        }
+      }
+    }
+  }
+}
+'''
+
+RUN_BULK_MUTATION = '''
+mutation bulkOperationRunQuery($query: String!) {
+  bulkOperationRunQuery(query: $query) {
+    bulkOperation {
+      id
+      status
+    }
+    userErrors {
+      field
+      message
+    }
+  }
+}
+'''
+
+CURRENT_BULK_QUERY = '''
+{
+  currentBulkOperation {
+    id
+    status
+    errorCode
+    objectCount
+    url
+  }
+}
+'''
+
+##########################
+# Shopify Bulk Operation #
+##########################
+
+
+def graphql(session, limiter, query, variables=None):
+    '''Send a query to the Shopify Admin GraphQL API and return its data
+
+    Keyword arguments:
+    session -- requests session
+    limiter -- rate_limit.RateLimiter for GraphQL calls
+    query -- GraphQL query or mutation
+    variables -- dictionary of query variables
+    '''
+    headers = {
+        "X-Shopify-Access-Token": SHOPIFY_PASSWORD,
+        "Content-Type": "application/json"
+    }
+    response = limiter.post(
+        session,
+        GRAPHQL_URL,
+        headers=headers,
+        json={'query': query, 'variables': variables or {}},
+    )
+    response_data = response.json()
+    if response_data.get('errors'):
+        raise RuntimeError(f'Shopify GraphQL error: {response_data["errors"]}')
+    return response_data['data']
+
+
+def run_bulk_query(session, limiter, query, poll_interval=POLL_INTERVAL):
+    '''Submit a bulk operation, wait for it and return its result URL
+
+    Returns None when the operation completed without any objects.
+
+    Keyword arguments:
+    session -- requests session
+    limiter -- rate_limit.RateLimiter for GraphQL calls
+    query -- GraphQL query to run as a bulk operation
+    poll_interval -- seconds between status checks
+
+    Reference:
+    https://shopify.dev/api/usage/bulk-operations/queries
+    '''
+    result = graphql(session, limiter, RUN_BULK_MUTATION,
+                     {'query': query})['bulkOperationRunQuery']
+    if result['userErrors']:
+        raise RuntimeError(f'Bulk operation rejected: {result["userErrors"]}')
+    operation_id = result['bulkOperation']['id']
+
+    while True:
+        time.sleep(poll_interval)
+        operation = graphql(session, limiter,
+                            CURRENT_BULK_QUERY)['currentBulkOperation']
+        if operation is None or operation['id'] != operation_id:
+            raise RuntimeError(f'Bulk operation {operation_id} was replaced')
+        if operation['status'] == 'COMPLETED':
+            print(f'Bulk operation completed: '
+                  f'{operation["objectCount"]} objects')
+            return operation['url']
+        if operation['status'] in ('FAILED', 'CANCELED', 'EXPIRED'):
+            raise RuntimeError(f'Bulk operation {operation["status"]}: '
+                               f'{operation["errorCode"]}')
+        print(f'Bulk operation {operation["status"]}: '
+              f'{operation["objectCount"]} objects')
+
+
+def iter_jsonl(session, url):
+    '''Yield each object of a remote JSONL file, one line at a time
+
+    Keyword arguments:
+    session -- requests session
+    url -- URL of the JSONL file
+    '''
+    with session.get(url, stream=True) as response:
+        response.raise_for_status()
+        for line in response.iter_lines():
+            if line:
+                yield json.loads(line)
+
+
+def local_time(value):
+    '''Convert a UTC timestamp string to the shop timezone (None stays None)
+
+    Bulk timestamps are UTC; REST orders carry the shop's local offset.
+    '''
+    if value is None:
+        return None
+    return pd.Timestamp(value).tz_convert(SHOP_TZ).isoformat()
+
+
+def iter_bulk_orders(objects):
+    '''Rebuild REST-shaped orders from flat bulk operation objects
+
+    Line items point back at their order through __parentId and follow it
+    in the file, so only the current order is held in memory.
+
+    Keyword arguments:
+    objects -- iterable of JSONL objects from a bulk order query
+    '''
+    order = None
+    for obj in objects:
+        parent_id = obj.get('__parentId')
+        if parent_id is None:
+            if order is not None:
+                yield order
+            order = {
+                'id': obj['id'],
+                'email': obj.get('email'),
+                'order_number': obj['number'],
+                'created_at': local_time(obj.get('createdAt')),
+                'updated_at': local_time(obj.get('updatedAt')),
+                'cancelled_at': local_time(obj.get('cancelledAt')),
+                'line_items': [],
+            }
+        elif order is not None and parent_id == order['id']:
+            order['line_items'].append({'sku': obj.get('sku')})
+        else:
+            raise ValueError(f'Line item {obj.get("id")} does not follow '
+                             f'its order {parent_id}')
+    if order is not None:
+        yield order
+
+
+def get_shopify_bulk_orders(updated_at_min=None, page_size=250,
+                            poll_interval=POLL_INTERVAL):
+    '''Export orders with a bulk operation and yield them in pages
+
+    Yields lists of orders shaped like get_shopify_order_api pages, so
+    callers can switch between the REST and bulk engines.
+
+    Keyword arguments:
+    updated_at_min -- only export orders updated at or after this ISO 8601
+                      timestamp (default None exports all orders)
+    page_size -- number of orders per yielded page
+    poll_interval -- seconds between bulk operation status checks
+    '''
+    if updated_at_min is None:
+        order_filter = ''
+    else:
+        order_filter = f'(query: "updated_at:>=\'{updated_at_min}\'")'
+    query = ORDER_BULK_QUERY % order_filter
+    limiter = RateLimiter(requests_per_second=2)
+
+    session = shared_session()
+    url = run_bulk_query(session, limiter, query, poll_interval)
+    if url is None:
+        return
+    page = []
+    for order in iter_bulk_orders(iter_jsonl(session, url)):
+        page.append(order)
+        if len(page) == page_size:
+            yield page
+            page = []
+    if page:
+        yield page
@@ -0,0 +1,129 @@
+# snapshots.py
+# Publish the datasets the Dash pages load at startup as Arrow (Feather v2)
+# files, and load them through a memory map, so workers start without
+# querying Postgres. Only the file read is shared: each worker builds its
+# own DataFrame from the mapped file.
+
+###########
+# IMPORTS #
+###########
+
+# Import Packages #
+import os
+import pyarrow as pa
+import pyarrow.feather as feather
+
+# Import local modules #
+from data_cache.db import read_sql
+from data_cache.dtypes import compact_frame
+from data_cache.etl_state import STATE_TABLE
+
+# Import .env variables #
+from dotenv import load_dotenv
+load_dotenv()  # take environment variables from .env
+SNAPSHOT_DIR = os.getenv(
+    'SNAPSHOT_DIR', os.path.join(os.path.dirname(__file__), 'snapshots'))
+
+# Tables the pages read, and the ETL state key committed together with
+# each table's changes. The key's updated_at is the table's version.
+SNAPSHOT_SOURCES = {
+    'cancel_monthly_reason': 'cancel_db.updated_at',
+    'retention_weekly_cohort': 'active_sub.updated_at',
+}
+SNAPSHOT_TABLES = list(SNAPSHOT_SOURCES)
+
+
+def snapshot_path(table):
+    '''Return the Arrow snapshot file of a table'''
+    return os.path.join(SNAPSHOT_DIR, f'{table}.arrow')
+
+
+def dataset_version(table):
+    '''Return the version of a table's data last committed by the ETL
+
+    The version is the time the ETL last set the table's state key, or ''
+    before its first run.
+
+    Keyword arguments:
+    table -- table name (one of SNAPSHOT_TABLES)
+    '''
+    df = read_sql(f'SELECT updated_at FROM {STATE_TABLE} WHERE name = :name',
+                  {'name': SNAPSHOT_SOURCES[table]})
+    return '' if df.empty else str(df['updated_at'].iloc[0])
+
+
+def snapshot_version(table):
+    '''Return the version stored in a table's snapshot (None if missing)
+
+    Keyword arguments:
+    table -- table name (one of SNAPSHOT_TABLES)
+    '''
+    path = snapshot_path(table)
+    if not os.path.exists(path):
+        return None
+    metadata = pa.ipc.open_file(pa.memory_map(path)).schema.metadata or {}
+    return metadata.get(b'version', b'').decode()
+
+
+def publish_snapshot(table, version=None):
+    '''Write the current rows of table to its Arrow snapshot
+
+    The file is written uncompressed so readers can map it without a copy,
+    and replaced atomically, so a worker that has the old file mapped keeps
+    reading a complete snapshot.
+
+    Keyword arguments:
+    table -- table name (one of SNAPSHOT_TABLES)
+    version -- version stored with the rows (default dataset_version)
+    '''
+    if version is None:
+        version = dataset_version(table)
+    os.makedirs(SNAPSHOT_DIR, exist_ok=True)
+    df = compact_frame(read_sql(f'SELECT * FROM {table}'), table)
+    arrow_table = pa.Table.from_pandas(df, preserve_index=False)
+    arrow_table = arrow_table.replace_schema_metadata(
+        {**(arrow_table.schema.metadata or {}), b'version': version.encode()})
+    path = snapshot_path(table)
+    # Workers may publish the same table at once; each writes its own file
+    temp_path = f'{path}.{os.getpid()}.tmp'
+    feather.write_feather(arrow_table, temp_path, compression='uncompressed')
+    os.replace(temp_path, path)
+    print(f'snapshot: {table} ({len(df)} rows, version {version}) -> {path}')
+
+
+def refresh_snapshot(table):
+    '''Publish a table's snapshot if the ETL committed newer data than it
+    holds, and return the current version
+
+    Lets web dynos follow an ETL that runs on another machine (a Heroku
+    scheduler dyno) and cannot write their snapshot files.
+
+    Keyword arguments:
+    table -- table name (one of SNAPSHOT_TABLES)
+    '''
+    version = dataset_version(table)
+    if snapshot_version(table) != version:
+        publish_snapshot(table, version)
+    return version
+
+
+def load_snapshot(table):
+    '''Return a DataFrame of table read from its memory-mapped snapshot
+
+    The file is read through the page cache without a copy, but the
+    DataFrame is not shared. to_pandas and compact_frame copy string,
+    categorical and converted columns into the worker's own memory.
+    A missing snapshot is published from Postgres first. Under
+    gunicorn --preload this happens once in the master before it forks.
+
+    Keyword arguments:
+    table -- table name (one of SNAPSHOT_TABLES)
+    '''
+    path = snapshot_path(table)
+    if not os.path.exists(path):
+        publish_snapshot(table)
+    # Columns to_pandas did not copy keep the map open while referenced
+    source = pa.memory_map(path)
+    arrow_table = pa.ipc.open_file(source).read_all()
+    # Snapshots published before compact dtypes are converted on load
+    return compact_frame(arrow_table.to_pandas(split_blocks=True), table)
@@ -8,32 +8,68 @@
 
 # Import Packages #
 
+import argparse
 from dotenv import load_dotenv
+import json
 import os
 import pandas as pd
-import requests
-from sqlalchemy import create_engine
-from sqlalchemy.types import DateTime
-import time
+from sqlalchemy import text
+from urllib.parse import quote
+
+# Import local modules #
+from data_cache.config import SHARD_START, SHOPIFY_API_URL
+from data_cache.db import get_engine
+from data_cache.dtypes import compact_frame
+from data_cache.etl_state import (ChangeFilter, delete_state, get_state,
+                                  latest_update, set_state, touch_state)
+from data_cache.http_client import shared_session
+from data_cache.loader import (copy_rows, create_partition_staging,
+                               create_staging_table, staging_table,
+                               swap_partition, swap_table)
+from data_cache.pagination import (PAGES_DONE, date_windows, iter_page_cursors,
+                                   iter_sharded_pages)
+from data_cache.rate_limit import shopify_limiter
+from data_cache.rollups import refresh_retention
+from data_cache.schema import (create_partitions, ensure_schema, is_partitioned,
+                               partition_month, partition_months,
+                               partition_name)
+from data_cache.snapshots import publish_snapshot
+from data_cache.shopify_bulk import get_shopify_bulk_orders
 
 # Import .env variables #
 load_dotenv()  # take environment variables from .env
 SHOPIFY_PASSWORD = os.getenv('SHOPIFY_PASSWORD')
-DATABASE_URL = os.getenv('DATABASE_URL')
-# replace database_url prefix w/ 'postgresql' so sqlalchemy create_engine works
-HEROKU_DB_URL = DATABASE_URL.replace('postgres://', 'postgresql://')
+
+# State key holding the updated_at watermark of the last successful sync
+WATERMARK_KEY = 'active_sub.updated_at'
+# State key holding the page cursors of an unfinished sync
+RESUME_KEY = 'active_sub.resume'
+# State key holding the fingerprints of records at the watermark
+FINGERPRINT_KEY = 'active_sub.fingerprints'
 
 #####################################
 # Get Data from Shopify Order API ###
 #####################################
 
 
-def get_shopify_order_api(endpoint, status):
-    '''Request and hold paginated data from the Shopify Order API
+def get_shopify_order_api(endpoint, status, updated_at_min=None, limiter=None,
+                          created_at_min=None, created_at_max=None,
+                          page_url=None):
+    '''Request paginated data from the Shopify Order API
+
+    Yields (records, next_url) for each page, next_url None on the last.
 
     Keyword arguments:
     status -- that status of the order('open', 'closed', 'cancelled', 'any')
     endpoint -- the target Shopify endpoint
+    updated_at_min -- only fetch orders updated at or after this ISO 8601
+                      timestamp (default None fetches all orders)
+    limiter -- shared rate_limit.BucketRateLimiter (default a new
+               Shopify limiter)
+    created_at_min -- only fetch orders created at or after this timestamp
+    created_at_max -- only fetch orders created at or before this timestamp
+    page_url -- next_url of an earlier page to resume from (the filters
+                above are already part of it)
 
     Reference:
     https://shopify.dev/api/admin/rest/reference/orders/order
@@ -43,81 +79,340 @@ def get_shopify_order_api(endpoint, status):
         "X-Shopify-Access-Token": SHOPIFY_PASSWORD,
         "Content-Type": "application/json"
     }
-    shop = "the-good-kitchen-esc.myshopify.com"
     endpoint = endpoint
     status = status
     limit = 250
-    fields = 'email,order_number,created_at,cancelled_at,line_items'
-    url = (f'https://{shop}/{endpoint}?fields={fields}&status={status}'
+    fields = ('id,email,order_number,created_at,updated_at,cancelled_at,'
+              'line_items')
+    url = (f'{SHOPIFY_API_URL}/{endpoint}?fields={fields}&status={status}'
            f'&limit={limit}')
+    filters = {
+        'updated_at_min': updated_at_min,
+        'created_at_min': created_at_min,
+        'created_at_max': created_at_max,
+    }
+    for name, value in filters.items():
+        if value is not None:
+            url += f'&{name}={quote(value)}'
 
-    # Access and store first page of results
-    session = requests.Session()
-    response = session.get(url, headers=headers)
-    response_data = response.json()
-    all_records = response_data['orders']
-
-    # While Next Link is present, access and store next page
-    count = 0
-    while "next" in response.links:
-        next_url = response.links["next"]["url"]
-        response = session.get(next_url, headers=headers)
-        count += 1
-        # print(f'# of request cycles: {count}')
-        response_data = response.json()
-        all_records.extend(response_data['orders'])
-        # Sleep to avoid rate limit if approach bucket size
-        if response.headers['X-Shopify-Shop-Api-Call-Limit'] == '79/80':
-            time.sleep(0.25)
-
-    return all_records
+    if limiter is None:
+        limiter = shopify_limiter()
+
+    # Yield one page of results at a time
+    yield from iter_page_cursors(
+        session=shared_session(),
+        url=url if page_url is None else page_url,
+        key='orders',
+        limiter=limiter,
+        headers=headers,
+    )
 
 #########
 
 
 def generate_active_order_df(records):
-    '''Create and store active order DataFrame in database
+    '''Create active subscription order DataFrame
+
+    Orders are flattened in a single pass that skips cancelled orders and
+    line items without a subscription sku while parsing, so only the rows
+    that are kept are ever built.
 
     Keyword arguments:
     records -- dictionary of records from API
-    path -- file path to write encrypted DataFrame
     '''
-
-    # Generate df from json and trim it to target
     # Keep active (non-cancelled) subscription orders.
     # Keep customer email, order number, order creation date,
     # subscription sku, and cancelled_at date.
-    # Convert created_at to datetime
-    df_orders_sub = pd.json_normalize(
-        records,
-        record_path='line_items',
-        meta=['email', 'order_number', 'created_at', 'cancelled_at']
+    emails, order_numbers, created_at, skus = [], [], [], []
+    for order in records:
+        if order.get('cancelled_at') is not None:
+            continue
+        for line_item in order['line_items']:
+            sku = line_item.get('sku')
+            if sku is None or 'SUB' not in sku:
+                continue
+            emails.append(order.get('email'))
+            order_numbers.append(order['order_number'])
+            created_at.append(order['created_at'])
+            skus.append(sku)
+
+    # Convert to the compact active_sub dtypes (datetimes, categorical skus)
+    return compact_frame(pd.DataFrame({
+        'email': pd.Series(emails, dtype='object'),
+        'order_number': pd.Series(order_numbers, dtype='int64'),
+        'created_at': pd.Series(created_at, dtype='object'),
+        'sku': pd.Series(skus, dtype='object'),
+        'cancelled_at': pd.Series([None] * len(skus), dtype='object'),
+    }), 'active_sub')
+
+
+def store_active_orders(df_orders_sub, con, table='active_sub'):
+    '''Append active subscription rows to the active_sub table with COPY
+
+    Keyword arguments:
+    df_orders_sub -- DataFrame from generate_active_order_df
+    con -- sqlalchemy connection inside a transaction
+    table -- target table (active_sub or a staging table of it)
+    '''
+    copy_rows(con, df_orders_sub, table, schema_table='active_sub')
+
+
+def upsert_active_orders(df_orders_sub, records, con):
+    '''Replace the active_sub rows of every order in records
+
+    Rows of changed orders are deleted and re-inserted, so orders that
+    were cancelled or lost their subscription items drop out of the table.
+    The delete is limited to the created_at months of the orders, so only
+    their partitions are scanned. Returns the set of customer emails whose
+    rows changed.
+
+    Keyword arguments:
+    df_orders_sub -- DataFrame from generate_active_order_df
+    records -- dictionary of changed orders from API
+    con -- sqlalchemy connection inside a transaction
+    '''
+    order_numbers = [record['order_number'] for record in records]
+    months = partition_months(pd.DataFrame(records), 'active_sub')
+    removed = con.execute(
+        text('''
+            DELETE FROM active_sub
+            WHERE order_number = ANY(:order_numbers)
+            AND created_at >= :created_at_min AND created_at < :created_at_max
+            RETURNING email
+        '''),
+        {'order_numbers': order_numbers,
+         'created_at_min': min(months),
+         'created_at_max': max(months) + pd.offsets.MonthBegin(1)},
+    ).scalars().all()
+    store_active_orders(df_orders_sub, con)
+    return set(removed) | set(df_orders_sub['email'])
+
+
+def start_sync(engine, watermark, shards, source='rest'):
+    '''Return the progress of an unfinished sync to resume, or a new one
+
+    The stored progress is only resumed when it was started with the
+    same watermark, source and number of shards.
+
+    Keyword arguments:
+    engine -- sqlalchemy engine
+    watermark -- updated_at_min of this sync (None for a full sync)
+    shards -- number of created_at windows
+    source -- 'rest' or 'bulk'
+    '''
+    progress = json.loads(get_state(engine, RESUME_KEY, 'null'))
+    if (progress is not None
+            and progress['updated_at_min'] == watermark
+            and progress.get('source', 'rest') == source
+            and len(progress['windows']) == shards):
+        print(f'active_sub sync: resuming after {progress["orders"]} orders')
+        return progress
+
+    run_started = pd.Timestamp.now(tz='UTC')
+    if watermark is None:
+        with engine.begin() as con:
+            create_staging_table(con, 'active_sub')
+    return {
+        'updated_at_min': watermark,
+        'source': source,
+        'run_started': run_started.isoformat(),
+        'last_seen': None,
+        'windows': date_windows(pd.Timestamp(SHARD_START, tz='UTC'),
+                                run_started, shards),
+        'cursors': [None] * shards,
+        'orders': 0,
+        'rows': 0,
+    }
+
+
+def sync_active_orders(engine, full=False, source='rest', shards=1):
+    '''Sync active_sub with the Shopify Order API
+
+    Incremental runs only fetch orders updated since the stored watermark
+    and upsert their rows. A full run (or the first run) loads every order
+    into a staging table with COPY, indexes it and swaps it in for
+    active_sub at the end, so readers never see a partial table. Pages are
+    transformed and written as they arrive, so memory stays at about one
+    page whatever the order history size.
+
+    Each REST page commits together with the page cursors and the
+    retention cohorts of the customers it changed, so a failed run
+    resumes from the last stored page on the next run.
+
+    The stored watermark is the newest updated_at seen, capped at the run
+    start time so orders that change while the pages are being fetched are
+    picked up next run. Orders fetched again from the watermark are skipped
+    when the last sync already loaded them unchanged. Returns the number of
+    new or changed orders loaded (0 when nothing changed).
+
+    Keyword arguments:
+    engine -- sqlalchemy engine
+    full -- ignore the watermark and rebuild active_sub from every order
+    source -- 'rest' pages the Order API, 'bulk' runs a GraphQL bulk
+              operation and streams its JSONL result
+    shards -- number of created_at windows the REST source walks in
+              parallel under one shared rate limit
+    '''
+    ensure_schema(engine, 'active_sub')
+    ensure_schema(engine, 'retention_customer')
+    ensure_schema(engine, 'retention_weekly_cohort')
+    watermark = None if full else get_state(engine, WATERMARK_KEY)
+    progress = start_sync(engine, watermark, shards, source=source)
+    changes = ChangeFilter(json.loads(get_state(engine, FINGERPRINT_KEY, '[]')))
+    if source == 'bulk':
+        pages = ((None, records, None)
+                 for records in get_shopify_bulk_orders(updated_at_min=watermark))
+    else:
+        limiter = shopify_limiter()
+
+        def fetch_window(created_at_min, created_at_max, page_url):
+            return get_shopify_order_api(
+                endpoint='admin/api/2021-07/orders.json',
+                status='any',
+                updated_at_min=watermark,
+                limiter=limiter,
+                created_at_min=created_at_min,
+                created_at_max=created_at_max,
+                page_url=page_url,
+            )
+        pages = iter_sharded_pages(fetch_window, progress['windows'],
+                                   progress['cursors'])
+
+    # Store each page together with the cursor that follows it
+    last_seen = progress['last_seen'] and pd.Timestamp(progress['last_seen'])
+    for index, records, next_url in pages:
+        if watermark is not None:
+            records = changes.new_records(records)
+        with engine.begin() as con:
+            if records:
+                df_orders_sub = generate_active_order_df(records)
+                if watermark is not None:
+                    emails = upsert_active_orders(df_orders_sub, records, con)
+                    refresh_retention(con, emails)
+                else:
+                    store_active_orders(df_orders_sub, con,
+                                        table=staging_table('active_sub'))
+                progress['orders'] += len(records)
+                progress['rows'] += len(df_orders_sub)
+                last_seen = latest_update(records, last_seen)
+                progress['last_seen'] = last_seen.isoformat()
+            if index is not None:
+                progress['cursors'][index] = next_url or PAGES_DONE
+                set_state(con, RESUME_KEY, json.dumps(progress))
+
+    # Swap in the rebuilt table and advance the watermark
+    with engine.begin() as con:
+        if watermark is None:
+            swap_table(con, 'active_sub')
+            refresh_retention(con)
+        if last_seen is not None:
+            run_started = pd.Timestamp(progress['run_started'])
+            next_watermark = min(last_seen, run_started)
+            set_state(con, WATERMARK_KEY, next_watermark.isoformat())
+            set_state(con, FINGERPRINT_KEY, changes.since(next_watermark))
+        delete_state(con, RESUME_KEY)
+
+    if watermark is not None and progress['orders'] == 0:
+        print(f'active_sub sync: no orders updated since {watermark}')
+        return 0
+    print(f'active_sub sync: {progress["orders"]} orders fetched, '
+          f'{progress["rows"]} active subscription rows written '
+          f'({"full" if watermark is None else "incremental"})')
+    return progress['orders']
+
+
+def rebuild_month(engine, month):
+    '''Re-pull the orders created in one month and swap in its partition
+
+    Only that month of active_sub is rewritten. Its orders are loaded into
+    a staging table, which replaces the month's partition when the load
+    commits, together with the retention cohorts of the month's customers.
+    The watermark keeps its value, but is marked as updated so the pages
+    and the retention snapshot pick up the new rows.
+
+    Keyword arguments:
+    engine -- sqlalchemy engine
+    month -- month to rebuild ('YYYY-MM')
+    '''
+    ensure_schema(engine, 'active_sub')
+    ensure_schema(engine, 'retention_customer')
+    ensure_schema(engine, 'retention_weekly_cohort')
+    start = pd.Period(month, freq='M').start_time
+    with engine.begin() as con:
+        if not is_partitioned(con, 'active_sub'):
+            print('active_sub month rebuild: active_sub is not partitioned '
+                  'yet, run a --full sync first')
+            return
+        create_partition_staging(con, 'active_sub', start)
+    partition = partition_name('active_sub', start)
+    staging = staging_table(partition)
+
+    # created_at filters are not in the stored wall time, so the window is
+    # padded by a day and rows are kept by their partition month
+    pad = pd.Timedelta(1, unit='D')
+    pages = get_shopify_order_api(
+        endpoint='admin/api/2021-07/orders.json',
+        status='any',
+        created_at_min=(start - pad).isoformat(),
+        created_at_max=(start + pd.offsets.MonthBegin(1) + pad).isoformat(),
     )
-    df_orders_sub = df_orders_sub.loc[:, ['email', 'order_number',
-                                          'created_at', 'sku', 'cancelled_at']]
-    df_orders_sub['created_at'] = pd.to_datetime(df_orders_sub['created_at'])
-    df_orders_sub['sku'].fillna('No SKU', inplace=True)
-    df_orders_sub = df_orders_sub[df_orders_sub['sku'].str.contains('SUB')]
-    df_orders_sub = df_orders_sub[df_orders_sub['cancelled_at'].isnull()]
-
-    # Convert DataFrame to sql and store in database
-    engine = create_engine(HEROKU_DB_URL, echo=False)
-    df_orders_sub.to_sql('active_sub',
-                         con=engine,
-                         if_exists='replace',
-                         index=False,
-                         dtype={'created_at': DateTime()}
-                         )
+    rows = 0
+    for records, next_url in pages:
+        df_orders_sub = generate_active_order_df(records)
+        df_orders_sub = df_orders_sub[
+            df_orders_sub['created_at'].map(partition_month) == start]
+        with engine.begin() as con:
+            store_active_orders(df_orders_sub, con, table=staging)
+        rows += len(df_orders_sub)
+
+    with engine.begin() as con:
+        create_partitions(con, 'active_sub', {start})
+        emails = con.execute(text(
+            f'SELECT email FROM {partition} UNION SELECT email FROM {staging}'
+        )).scalars().all()
+        swap_partition(con, 'active_sub', start)
+        refresh_retention(con, set(emails))
+        touch_state(con, WATERMARK_KEY)
+    print(f'active_sub month rebuild: {rows} active subscription rows '
+          f'written to {partition}')
 
 ##########################################
 # Get active Shopify subscription orders #
 ##########################################
 
 
-all_orders = get_shopify_order_api(
-    endpoint='admin/api/2021-07/orders.json',
-    status='any',
-)
-generate_active_order_df(
-    records=all_orders
-)
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(
+        description='Sync active subscription orders from Shopify')
+    parser.add_argument(
+        '--full',
+        action='store_true',
+        help='ignore the stored watermark and rebuild active_sub',
+    )
+    parser.add_argument(
+        '--source',
+        choices=['rest', 'bulk'],
+        default='rest',
+        help='page the REST Order API or run a GraphQL bulk operation',
+    )
+    parser.add_argument(
+        '--shards',
+        type=int,
+        default=1,
+        help='walk this many created_at windows of the REST API in parallel',
+    )
+    parser.add_argument(
+        '--month',
+        help='only rebuild the active_sub partition of this month (YYYY-MM)',
+    )
+    args = parser.parse_args()
+    if args.month:
+        rebuild_month(engine=get_engine(), month=args.month)
+    else:
+        sync_active_orders(
+            engine=get_engine(),
+            full=args.full,
+            source=args.source,
+            shards=args.shards,
+        )
+    publish_snapshot('retention_weekly_cohort')
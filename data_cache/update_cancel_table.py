@@ -7,81 +7,126 @@
 ###########
 
 # Import Packages #
+import argparse
+import json
 import pandas as pd
-import requests
-from sqlalchemy import create_engine
-import time
+from sqlalchemy import text
+from urllib.parse import quote
 
 # Import .env variables #
 from dotenv import load_dotenv
 import os
 load_dotenv()  # take environment variables from .env
 RECHARGE_API_TOKEN = os.getenv('RECHARGE_API_TOKEN')
-YOTPO_X_GUID = os.getenv('YOTPO_X_GUID')
-YOTPO_X_API_KEY = os.getenv('YOTPO_X_API_KEY')
-# replace database_url prefix w/ 'postgresql' so sqlalchemy create_engine works
-DATABASE_URL = os.getenv('DATABASE_URL')
-HEROKU_DB_URL = DATABASE_URL.replace('postgres://', 'postgresql://')
+
+# Import local modules #
+from data_cache.config import RECHARGE_API_URL, SHARD_START
+from data_cache.db import get_engine
+from data_cache.dtypes import compact_frame
+from data_cache.etl_state import ChangeFilter, get_state, latest_update, set_state
+from data_cache.http_client import shared_session
+from data_cache.loader import (copy_rows, create_staging_table, staging_table,
+                               swap_table)
+from data_cache.pagination import date_windows, iter_page_cursors, iter_sharded_pages
+from data_cache.rate_limit import recharge_limiter
+from data_cache.rollups import cancel_months, refresh_cancel_rollup
+from data_cache.schema import ensure_schema
+from data_cache.snapshots import publish_snapshot
+from data_cache.yotpo import BALANCE_TABLE, refresh_cached_balances
+
+# State key holding the updated_at checkpoint of the last successful sync
+CHECKPOINT_KEY = 'cancel_db.updated_at'
+# State key holding the fingerprints of records in the checkpoint overlap
+FINGERPRINT_KEY = 'cancel_db.fingerprints'
+# Re-read this much history before the checkpoint. Recharge timestamps carry
+# no UTC offset, so the overlap absorbs changes made while a sync was running.
+CHECKPOINT_OVERLAP = pd.Timedelta(1, unit='h')
+# Only customers who cancelled within this many days get a yotpo balance
+YOTPO_CUTOFF_DAYS = 90
+# Subscription ids sent per request with Recharge's ids filter
+ID_BATCH_SIZE = 250
 
 ###########################################
 # Get Data from Recharge Subscription API #
 ###########################################
 
 
-def get_recharge_sub_api(status):
-    '''Request and hold paginated data from the Recharge Subscription API
+def get_recharge_sub_api(status, updated_at_min=None, limiter=None,
+                         created_at_min=None, created_at_max=None,
+                         page_url=None, ids=None):
+    '''Request paginated data from the Recharge Subscription API
+
+    Yields (records, next_url) for each page, next_url None on the last.
 
     Keyword arguments:
     status -- the status of the subscription ('ACTIVE', 'CANCELLED', 'EXPIRED')
+    updated_at_min -- only fetch subscriptions updated at or after this
+                      timestamp (default None fetches all subscriptions)
+    limiter -- shared rate_limit.BucketRateLimiter (default a new
+               Recharge limiter)
+    created_at_min -- only fetch subscriptions created after this timestamp
+    created_at_max -- only fetch subscriptions created before this timestamp
+    page_url -- next_url of an earlier page to continue from
+    ids -- only fetch the subscriptions with these ids
     '''
     # Set request variables
     headers = {'X-Recharge-Access-Token': RECHARGE_API_TOKEN}
     status = status
     limit = 250
 
-    # Access and store first page of subscription results
-    url = f'https://api.rechargeapps.com/subscriptions?status={status}&limit={limit}'
-    response = requests.get(url, headers=headers)
-    response_data = response.json()
-    all_records = response_data['subscriptions']
+    # Yield one page of subscription results at a time
+    url = f'{RECHARGE_API_URL}/subscriptions?status={status}&limit={limit}'
+    filters = {
+        'updated_at_min': updated_at_min,
+        'created_at_min': created_at_min,
+        'created_at_max': created_at_max,
+        'ids': None if ids is None else ','.join(str(id_) for id_ in ids),
+    }
+    for name, value in filters.items():
+        if value is not None:
+            url += f'&{name}={quote(value)}'
+    if limiter is None:
+        limiter = recharge_limiter()
+    yield from iter_page_cursors(
+        session=shared_session(),
+        url=url if page_url is None else page_url,
+        key='subscriptions',
+        limiter=limiter,
+        headers=headers,
+    )
 
-    # While Next Link is present, access and store next page
-    while 'next' in response.links:
-        next_url = response.links['next']['url']
-        response = requests.get(next_url, headers=headers)
-        response_data = response.json()
-        all_records.extend(response_data['subscriptions'])
-        # Sleep to avoid rate limit if approach threshold
-        if response.headers['X-Recharge-Limit'] == '39/40':
-            time.sleep(0.5)
 
-    return all_records
+def get_recharge_subs_by_id(status, ids, updated_at_min=None, limiter=None,
+                            batch_size=ID_BATCH_SIZE):
+    '''Request the subscriptions with the given ids and status
 
+    The ids are sent batch_size at a time with Recharge's ids filter.
+    Yields the records of each page.
 
-def get_yotpo_balance(customer_email):
-    ''' Retrieve customer yotpo balance
+    Keyword arguments:
+    status -- the status of the subscription ('ACTIVE', 'CANCELLED', 'EXPIRED')
+    ids -- subscription ids to fetch
+    updated_at_min -- only fetch subscriptions updated at or after this
+                      timestamp
+    limiter -- shared rate_limit.BucketRateLimiter (default a new
+               Recharge limiter)
+    batch_size -- number of ids per request
     '''
-    try:
-        url = "https://loyalty.yotpo.com/api/v2/customers"
-        querystring = {
-            "customer_email": customer_email,
-            "country_iso_code": "null",
-            "with_referral_code": "false",
-            "with_history": "false"
-        }
-        headers = {
-            "Accept": "application/json",
-            "x-guid": YOTPO_X_GUID,
-            "x-api-key": YOTPO_X_API_KEY
-        }
-        result = requests.get(url, headers=headers, params=querystring)
-        return result.json()["points_balance"]
-    except KeyError:
-        return 0
+    if limiter is None:
+        limiter = recharge_limiter()
+    for start in range(0, len(ids), batch_size):
+        pages = get_recharge_sub_api(
+            status=status,
+            updated_at_min=updated_at_min,
+            limiter=limiter,
+            ids=ids[start:start + batch_size],
+        )
+        for records, next_url in pages:
+            yield records
 
 
 def generate_dataframe(records):
-    '''Create and store cancellation DataFrame
+    '''Create cancellation DataFrame
 
     Keyword arguments:
     records -- dictionary of records from API
@@ -91,31 +136,224 @@ def generate_dataframe(records):
 
     # Keep columns customer email, when they cancelled,
     # the primary reason they cancelled, cancellation comments left.
+    # Keep the subscription id so later syncs can update the row.
     columns = ['email', 'cancelled_at', 'cancellation_reason',
-               'cancellation_reason_comments']
+               'cancellation_reason_comments', 'id']
     df_cancel = df.loc[:, columns]
+    df_cancel = df_cancel.rename(columns={'id': 'subscription_id'})
     # Convert 'cancelled_at' values to datetime format.
     df_cancel['cancelled_at'] = pd.to_datetime(df_cancel['cancelled_at'])
     # Replace null in 'cancellation_reason' with 'None'
     df_cancel['cancellation_reason'].fillna('None', inplace=True)
-    # Lookup yotpo balance for cancelled_at < 90d
-    cutoff_day = pd.Timestamp('now').floor('D') - pd.Timedelta(90, unit='D')
-    df_cancel['yotpo_point_balance'] = df_cancel.apply(
-        lambda row: get_yotpo_balance(row['email']) if row['cancelled_at'] > cutoff_day else 0,
-        axis=1
-        )
+    # Yotpo balances are joined in from the cache by update_yotpo_balances
+    df_cancel.insert(4, 'yotpo_point_balance', 0)
+    return compact_frame(df_cancel, 'cancel_db')
 
-    # Convert DataFrame to sql and store in database
-    engine = create_engine(HEROKU_DB_URL, echo=False)
-    df_cancel.to_sql('cancel_db', con=engine, if_exists='replace', index=False)
 
-# Get and store cancelled subscriptions #
+def merge_cancellations(df_cancel, subscription_ids, con):
+    '''Replace the cancel_db rows of every changed subscription
+
+    Returns the set of cancelled_at months whose rows were removed or
+    added, for refreshing the monthly rollup.
+
+    Keyword arguments:
+    df_cancel -- DataFrame of cancellations from generate_dataframe, or None
+                 when the subscriptions are no longer cancelled
+    subscription_ids -- ids of the changed subscriptions
+    con -- sqlalchemy connection inside a transaction
+    '''
+    removed = con.execute(
+        text('''
+            DELETE FROM cancel_db WHERE subscription_id = ANY(:ids)
+            RETURNING date_trunc('month', cancelled_at)
+        '''),
+        {'ids': subscription_ids},
+    ).scalars().all()
+    months = {month for month in removed if month is not None}
+    if df_cancel is not None:
+        copy_rows(con, df_cancel, 'cancel_db')
+        months |= cancel_months(df_cancel)
+    return months
+
+
+def sync_cancellations(engine, full=False, shards=1):
+    '''Sync cancel_db with the Recharge Subscription API
+
+    Delta runs fetch subscriptions updated since the stored checkpoint.
+    Cancelled ones are merged into cancel_db. Of the active and expired
+    subscriptions, only those already in cancel_db are looked up by id, in
+    batches of ID_BATCH_SIZE, and removed when they were updated. Routine
+    updates of other active subscriptions are never paged, so a delta run
+    costs the new cancellations plus one request per ID_BATCH_SIZE rows of
+    cancel_db for each of the two statuses. A full run (or the first run) COPYs every page into a
+    staging table and swaps it in for cancel_db when the load commits.
+    Pages are transformed and written as they arrive. The monthly reason
+    rollup is refreshed for the affected months in the same transaction.
+    Subscriptions refetched by the checkpoint overlap are skipped when the
+    last sync already loaded them unchanged. Returns the number of new or
+    changed subscriptions loaded (0 when nothing changed).
 
+    Keyword arguments:
+    engine -- sqlalchemy engine
+    full -- ignore the checkpoint and re-pull every cancelled subscription
+    shards -- number of created_at windows walked in parallel under one
+              shared rate limit
+    '''
+    ensure_schema(engine, 'cancel_db')
+    ensure_schema(engine, 'cancel_monthly_reason')
+    checkpoint = None if full else get_state(engine, CHECKPOINT_KEY)
+    changes = ChangeFilter(json.loads(get_state(engine, FINGERPRINT_KEY, '[]')))
+    if checkpoint is None:
+        updated_at_min = None
+        statuses = ['CANCELLED']
+    else:
+        updated_at_min = (pd.Timestamp(checkpoint)
+                          - CHECKPOINT_OVERLAP).isoformat()
+        # Also fetch subscriptions that left the cancelled state
+        statuses = ['CANCELLED', 'ACTIVE', 'EXPIRED']
+    record_counts = dict.fromkeys(statuses, 0)
+    affected_months = set()
+    last_seen = None
+    limiter = recharge_limiter()
+    windows = date_windows(SHARD_START, pd.Timestamp('now'), shards)
+
+    # Store rows and checkpoint in one transaction
+    with engine.begin() as con:
+        if checkpoint is None:
+            create_staging_table(con, 'cancel_db')
+        for status in statuses:
+            if status == 'CANCELLED':
+                def fetch_window(created_at_min, created_at_max, page_url):
+                    return get_recharge_sub_api(
+                        status='CANCELLED',
+                        updated_at_min=updated_at_min,
+                        limiter=limiter,
+                        created_at_min=created_at_min,
+                        created_at_max=created_at_max,
+                        page_url=page_url,
+                    )
+                pages = (records for index, records, next_url
+                         in iter_sharded_pages(fetch_window, windows))
+            else:
+                # Read after the cancellations were merged, so it includes
+                # subscriptions cancelled and reactivated since the checkpoint
+                cancelled_ids = con.execute(text(
+                    'SELECT subscription_id FROM cancel_db '
+                    'WHERE subscription_id IS NOT NULL'
+                )).scalars().all()
+                pages = get_recharge_subs_by_id(
+                    status=status,
+                    ids=cancelled_ids,
+                    updated_at_min=updated_at_min,
+                    limiter=limiter,
+                )
+            for records in pages:
+                if checkpoint is not None:
+                    records = changes.new_records(records)
+                if not records:
+                    continue
+                if status == 'CANCELLED':
+                    df_cancel = generate_dataframe(records)
+                else:
+                    df_cancel = None
+                if checkpoint is not None:
+                    affected_months |= merge_cancellations(
+                        df_cancel=df_cancel,
+                        subscription_ids=[record['id'] for record in records],
+                        con=con,
+                    )
+                else:
+                    copy_rows(con, df_cancel, staging_table('cancel_db'),
+                              schema_table='cancel_db')
+                record_counts[status] += len(records)
+                last_seen = latest_update(records, last_seen)
+        if checkpoint is None:
+            swap_table(con, 'cancel_db')
+        refresh_cancel_rollup(
+            con, months=None if checkpoint is None else affected_months)
+        if last_seen is not None:
+            set_state(con, CHECKPOINT_KEY, last_seen.isoformat())
+            set_state(con, FINGERPRINT_KEY,
+                      changes.since(last_seen - CHECKPOINT_OVERLAP))
+
+    if checkpoint is None:
+        print(f'cancel_db sync: {record_counts["CANCELLED"]} cancellations '
+              f'written (full)')
+    elif last_seen is None:
+        print(f'cancel_db sync: no subscriptions updated since {checkpoint}')
+    else:
+        print(f'cancel_db sync: {record_counts["CANCELLED"]} cancellations '
+              f'merged, {record_counts["ACTIVE"] + record_counts["EXPIRED"]} '
+              f'reactivated or expired (delta)')
+    return sum(record_counts.values())
+
+
+def update_yotpo_balances(engine):
+    '''Join cached yotpo balances into cancel_db
+
+    Customers who cancelled within YOTPO_CUTOFF_DAYS get their cached
+    balance. Only balances that are new or past the cache TTL are looked up
+    again. Older cancellations are reset to 0.
+
+    Keyword arguments:
+    engine -- sqlalchemy engine
+    '''
+    cutoff_day = (pd.Timestamp('now').floor('D')
+                  - pd.Timedelta(YOTPO_CUTOFF_DAYS, unit='D'))
+    with engine.connect() as con:
+        recent_emails = con.execute(
+            text('SELECT DISTINCT email FROM cancel_db WHERE cancelled_at > :cutoff'),
+            {'cutoff': cutoff_day},
+        ).scalars().all()
+    lookups = refresh_cached_balances(engine, recent_emails)
+
+    with engine.begin() as con:
+        con.execute(
+            text(f'''
+                UPDATE cancel_db c
+                SET yotpo_point_balance = COALESCE(
+                    (SELECT y.points_balance FROM {BALANCE_TABLE} y
+                     WHERE y.email = c.email), 0)
+                WHERE c.cancelled_at > :cutoff
+            '''),
+            {'cutoff': cutoff_day},
+        )
+        con.execute(
+            text('''
+                UPDATE cancel_db
+                SET yotpo_point_balance = 0
+                WHERE cancelled_at <= :cutoff AND yotpo_point_balance <> 0
+            '''),
+            {'cutoff': cutoff_day},
+        )
+    print(f'yotpo balances: {len(recent_emails)} recent customers, '
+          f'{lookups} looked up')
+
+# Get and store cancelled subscriptions #
 
-cancellation_records = get_recharge_sub_api(
-    status='CANCELLED'
-)
 
-generate_dataframe(
-    records=cancellation_records
-)
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(
+        description='Sync cancelled subscriptions from Recharge')
+    parser.add_argument(
+        '--full',
+        action='store_true',
+        help='ignore the stored checkpoint and re-pull every cancellation',
+    )
+    parser.add_argument(
+        '--shards',
+        type=int,
+        default=1,
+        help='walk this many created_at windows in parallel',
+    )
+    args = parser.parse_args()
+    engine = get_engine()
+    sync_cancellations(
+        engine=engine,
+        full=args.full,
+        shards=args.shards,
+    )
+    update_yotpo_balances(
+        engine=engine,
+    )
+    publish_snapshot('cancel_monthly_reason')
@@ -0,0 +1,200 @@
+# yotpo.py
+# Look up Yotpo loyalty point balances for many customers concurrently.
+
+###########
+# IMPORTS #
+###########
+
+# Import Packages #
+from concurrent.futures import ThreadPoolExecutor
+import pandas as pd
+import requests
+from sqlalchemy import text
+
+# Import .env variables #
+from dotenv import load_dotenv
+import os
+load_dotenv()  # take environment variables from .env
+YOTPO_X_GUID = os.getenv('YOTPO_X_GUID')
+YOTPO_X_API_KEY = os.getenv('YOTPO_X_API_KEY')
+# Worker threads and request budget for balance lookups
+YOTPO_MAX_WORKERS = int(os.getenv('YOTPO_MAX_WORKERS', 8))
+YOTPO_REQUESTS_PER_SECOND = float(os.getenv('YOTPO_REQUESTS_PER_SECOND', 10))
+# Hours a cached balance stays fresh before it is looked up again
+YOTPO_BALANCE_TTL_HOURS = float(os.getenv('YOTPO_BALANCE_TTL_HOURS', 24))
+
+# Import local modules #
+from data_cache.config import YOTPO_API_URL
+from data_cache.http_client import shared_session
+from data_cache.rate_limit import RateLimiter
+
+YOTPO_CUSTOMER_URL = f'{YOTPO_API_URL}/api/v2/customers'
+BALANCE_TABLE = 'yotpo_balance'
+
+#######################
+# Yotpo Point Balance #
+#######################
+
+
+def get_yotpo_balance(customer_email, session=None, limiter=None):
+    ''' Retrieve customer yotpo balance
+
+    Returns 0 for customers Yotpo does not know or who have no balance, and
+    None when the lookup failed (retries exhausted, rejected key, network,
+    a body that is not JSON).
+
+    Keyword arguments:
+    customer_email -- email of the Yotpo customer
+    session -- requests session to send the request with (default the
+               shared pooled session)
+    limiter -- shared rate_limit.RateLimiter (default a new Yotpo limiter)
+    '''
+    if session is None:
+        session = shared_session()
+    if limiter is None:
+        limiter = RateLimiter(YOTPO_REQUESTS_PER_SECOND)
+    try:
+        querystring = {
+            "customer_email": customer_email,
+            "country_iso_code": "null",
+            "with_referral_code": "false",
+            "with_history": "false"
+        }
+        headers = {
+            "Accept": "application/json",
+            "x-guid": YOTPO_X_GUID,
+            "x-api-key": YOTPO_X_API_KEY
+        }
+        result = limiter.get(session, YOTPO_CUSTOMER_URL, headers=headers,
+                             params=querystring)
+        return result.json().get("points_balance") or 0
+    except requests.HTTPError as error:
+        if error.response is not None and error.response.status_code == 404:
+            return 0
+        print(f'yotpo balance lookup failed for {customer_email}: {error}')
+        return None
+    except (requests.RequestException, ValueError) as error:
+        # ValueError: a response body that is not JSON (e.g. an HTML page)
+        print(f'yotpo balance lookup failed for {customer_email}: {error}')
+        return None
+
+
+def get_yotpo_balances(customer_emails,
+                       max_workers=YOTPO_MAX_WORKERS,
+                       requests_per_second=YOTPO_REQUESTS_PER_SECOND,
+                       limiter=None):
+    '''Retrieve yotpo balances for many customers in parallel
+
+    Requests fan out over a bounded thread pool that shares the pooled
+    session and one request budget. Returns a DataFrame with one row per
+    email: email, yotpo_point_balance (None when the lookup failed),
+    latency (seconds of the HTTP calls) and wait (seconds queued for the
+    request budget).
+
+    Keyword arguments:
+    customer_emails -- iterable of customer emails (duplicates are dropped)
+    max_workers -- number of concurrent requests
+    requests_per_second -- request budget shared by all workers
+    limiter -- rate_limit.RateLimiter to use instead of a new one built
+               from requests_per_second
+    '''
+    customer_emails = list(dict.fromkeys(customer_emails))
+    if limiter is None:
+        limiter = RateLimiter(requests_per_second)
+    session = shared_session()
+
+    def timed_balance(customer_email):
+        balance = get_yotpo_balance(customer_email, session=session,
+                                    limiter=limiter)
+        return (balance, *limiter.last_call())
+
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        results = list(executor.map(timed_balance, customer_emails))
+
+    df_balance = pd.DataFrame(
+        results,
+        columns=['yotpo_point_balance', 'latency', 'wait'],
+    )
+    df_balance.insert(0, 'email', customer_emails)
+    if customer_emails:
+        latency = df_balance['latency']
+        print(f'yotpo balances: {len(df_balance)} calls, '
+              f'mean {latency.mean():.3f}s, p95 {latency.quantile(0.95):.3f}s, '
+              f'max {latency.max():.3f}s, '
+              f'mean wait for budget {df_balance["wait"].mean():.3f}s')
+    return df_balance
+
+#######################
+# Yotpo Balance Cache #
+#######################
+
+
+def ensure_balance_table(engine):
+    '''Create the yotpo balance cache table if it does not exist yet
+
+    Keyword arguments:
+    engine -- sqlalchemy engine
+    '''
+    with engine.begin() as con:
+        con.execute(text(f'''
+            CREATE TABLE IF NOT EXISTS {BALANCE_TABLE} (
+                email TEXT PRIMARY KEY,
+                points_balance INTEGER NOT NULL,
+                fetched_at TIMESTAMPTZ NOT NULL
+            )
+        '''))
+
+
+def refresh_cached_balances(engine, customer_emails,
+                            ttl_hours=YOTPO_BALANCE_TTL_HOURS):
+    '''Look up balances that are missing from the cache or past the TTL
+
+    Fresh balances are stored in the yotpo_balance table keyed by email.
+    Failed lookups are not stored, so the next run tries them again.
+    Returns the number of emails that were looked up.
+
+    Keyword arguments:
+    engine -- sqlalchemy engine
+    customer_emails -- emails that need a current balance
+    ttl_hours -- age after which a cached balance is looked up again
+    '''
+    ensure_balance_table(engine)
+    customer_emails = list(dict.fromkeys(customer_emails))
+    fresh_after = pd.Timestamp.now(tz='UTC') - pd.Timedelta(ttl_hours, unit='h')
+    with engine.connect() as con:
+        fresh_emails = set(con.execute(
+            text(f'''
+                SELECT email
+                FROM {BALANCE_TABLE}
+                WHERE email = ANY(:emails) AND fetched_at > :fresh_after
+            '''),
+            {'emails': customer_emails, 'fresh_after': fresh_after},
+        ).scalars())
+    stale_emails = [email for email in customer_emails
+                    if email not in fresh_emails]
+    if not stale_emails:
+        return 0
+
+    df_balance = get_yotpo_balances(stale_emails)
+    fetched_at = pd.Timestamp.now(tz='UTC').to_pydatetime()
+    rows = [
+        {'email': email, 'points_balance': int(balance),
+         'fetched_at': fetched_at}
+        for email, balance in zip(df_balance['email'],
+                                  df_balance['yotpo_point_balance'])
+        if balance is not None and not pd.isna(balance)
+    ]
+    if not rows:
+        return len(stale_emails)
+    with engine.begin() as con:
+        con.execute(
+            text(f'''
+                INSERT INTO {BALANCE_TABLE} (email, points_balance, fetched_at)
+                VALUES (:email, :points_balance, :fetched_at)
+                ON CONFLICT (email) DO UPDATE
+                SET points_balance = EXCLUDED.points_balance,
+                    fetched_at = EXCLUDED.fetched_at
+            '''),
+            rows,
+        )
+    return len(stale_emails)
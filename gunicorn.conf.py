@@ -0,0 +1,14 @@
+# gunicorn.conf.py
+# Settings gunicorn reads from the working directory (see Procfile).
+
+# Import local modules #
+from data_cache import refresher
+
+
+def post_fork(server, worker):
+    '''Start the page data refresher in every worker
+
+    The --preload master builds the page data once before forking, but never
+    runs the refresh thread itself.
+    '''
+    refresher.start_refresher()
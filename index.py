@@ -152,10 +152,10 @@ app.validation_layout = html.Div(
         page_container,
         index_layout,
         meal_tag.layout,
-        cancellations.layout,
-        cancellations2.layout,
-        retention_order.layout,
-        price_exempt.layout
+        cancellations.layout(),
+        cancellations2.layout(),
+        retention_order.layout(),
+        price_exempt.layout()
     ]
 )
 
@@ -181,4 +181,6 @@ def display_page(pathname):
         '/retention-by-order': retention_order.layout,
         '/price-exempt': price_exempt.layout
     }
-    return switcher.get(pathname, '404')
+    page = switcher.get(pathname, '404')
+    # Pages with refreshed data build their layout on each visit
+    return page() if callable(page) else page
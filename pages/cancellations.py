@@ -7,220 +7,220 @@ from dash_extensions import Download
 from dash_extensions.snippets import send_data_frame
 
 from datetime import date  # , timedelta, datetime as dt
-from dotenv import load_dotenv
-import os
 import pandas as pd
-import psycopg2
-import requests
-
-# Import .env variables
-
-load_dotenv()  # take environment variables from .env
-DATABASE_URL = os.getenv('DATABASE_URL')
-# replace database_url prefix w/ 'postgresql' so sqlalchemy create_engine works
-HEROKU_DB_URL = DATABASE_URL.replace('postgres://', 'postgresql://')
 
 # Import Dash Instance #
 from app import app
 
+# Import local modules #
+from data_cache.queries import CANCEL_COLUMNS, fetch_cancellations
+from data_cache import refresher
+from data_cache.snapshots import (load_snapshot, refresh_snapshot,
+                                  snapshot_version)
+
 # DATAFRAME #
-# Load cancelled subscription dataframe from database #
-con = psycopg2.connect(HEROKU_DB_URL)
-cur = con.cursor()
-query = f"""SELECT *
-            FROM cancel_db
-            """
-df_cancel = pd.read_sql(query, con)
-con.close()
+# Cancellations are queried per date range in the callbacks below. The
+# reason dropdown lists the reasons of the monthly rollup snapshot.
 
-# LAYOUT #
 
-# Layout Components
-datepicker_range = dcc.DatePickerRange(
-    id='date-picker-range',
-    min_date_allowed=date(2019, 6, 1),
-    max_date_allowed=date.today(),
-    initial_visible_month=date.today(),
-    start_date=pd.Timestamp('now').floor('D') - pd.Timedelta(7, unit="D"),
-    end_date=pd.Timestamp('today').floor('D'),
-)
+def build_reasons():
+    '''Return the sorted cancellation reasons of the monthly rollup'''
+    return sorted(
+        load_snapshot('cancel_monthly_reason')['cancellation_reason']
+        .dropna().unique()
+    )
 
-dropdown = dcc.Dropdown(
-    id='reason-dropdown',
-    options=[{'label': 'All Reasons', 'value': 'All Reasons'}] +
-            [{'label': i, 'value': i} for i in df_cancel['cancellation_reason'].drop_duplicates().sort_values()],
-    placeholder='Select a reason',
-    className='mb-2',
+
+refresher.register(
+    name='cancellation_reasons',
+    build=build_reasons,
+    version=lambda: refresh_snapshot('cancel_monthly_reason'),
+    built_version=lambda: snapshot_version('cancel_monthly_reason'),
 )
 
+# LAYOUT #
+
 # Page layout
-layout = html.Div(
-    children=[
-        dcc.Store(id='df_cancel_slice'),
-        html.H1('Cancellations'),
-        dbc.Row(
-            children=[
-                dbc.Col(datepicker_range),
-                dbc.Col(
-                    children=[
-                        html.Div(
-                            children='',
-                            id='cancel_total_box',
-                            className='pt-2',
-                        ),
-                    ],
-                    width='auto',
-                    className='border',
-                ),
-            ],
-            className='mb-3 mr-1',
-        ),
-        dbc.Card(
-            children=[
-                dbc.CardBody(
-                    children=[
-                        html.H4(
-                            children=[
-                                "Cancellation Counts"
-                            ],
-                            className='card-title',
-                        ),
-                        html.P(
-                            children=[
-                                "This table contains information for all \
-                                cancelled subscriptions within the selected \
-                                date range. It shows a list of each cancellation \
-                                reason and the number of times it occured."
-                            ],
-                            className='card-text'
-                        ),
-                        dbc.Spinner(
-                            children=[
-                                html.Div(
-                                    id="cancel_counts_container",
-                                ),
-                            ],
-                            color='primary',
-                        ),
-                    ],
-                ),
-            ],
-            color='secondary',
-            outline=True,
-            className='mb-3',
-        ),
-        dbc.Card(
-            children=[
-                dbc.CardBody(
-                    children=[
-                        html.H4(
-                            children=[
-                                'Cancellation Reason Comments'
-                            ],
-                            className='card-title',
-                        ),
-                        html.P(
-                            children=[
-                                'All customers are required to enter a \
-                                cancellation reason. They can optionally leave \
-                                a cancellation comment. When provided, here are \
-                                the cancellation reason comments.'
-                            ],
-                            className='card-text',
-                        ),
-                        dbc.Button(
-                            children=[
-                                'Download CSV'
-                            ],
-                            id='btn_reason_csv',
-                            color='primary',
-                            className='mb-3',
-                        ),
-                        Download(
-                            id='download_reason_csv',
-                        ),
-                        html.Div(id="cancel_reasons_container"),
-                    ],
-                ),
-            ],
-            color='secondary',
-            outline=True,
-            className='mb-3',
-        ),
-        dbc.Card(
-            children=[
-                dbc.CardBody(
-                    children=[
-                        html.H4(
-                            children=[
-                                'Customers by Cancellation Reason',
-                            ],
-                            className='card-title',
-                        ),
-                        html.P(
-                            children=[
-                                'This table lists all of the customers that \
-                                indicated a particular cancellation reason \
-                                when they cancelled.'
-                            ],
-                            className='card-text',
-                        ),
-                        dbc.Button(
-                            children=[
-                                'Download CSV'
-                            ],
-                            id='btn_reason_indiv_csv',
-                            color='primary',
-                            className='mb-3',
-                        ),
-                        Download(
-                            id='dl_reason_indiv_csv',
-                        ),
-                        dropdown,
-                        dbc.Spinner(
-                            children=[
-                                html.Div(id="customers_by_reason_container"),
-                            ],
-                            color='primary',
-                        ),
-                    ],
-                ),
-            ],
-            color='secondary',
-            outline=True,
-            className='mb-3',
-        ),
-    ]
-)
+
+
+def layout():
+    ''' Build the page with the current cancellation reasons
+    '''
+    cancellation_reasons = refresher.current('cancellation_reasons')
+
+    # Layout Components
+    datepicker_range = dcc.DatePickerRange(
+        id='date-picker-range',
+        min_date_allowed=date(2019, 6, 1),
+        max_date_allowed=date.today(),
+        initial_visible_month=date.today(),
+        start_date=pd.Timestamp('now').floor('D') - pd.Timedelta(7, unit="D"),
+        end_date=pd.Timestamp('today').floor('D'),
+    )
+
+    dropdown = dcc.Dropdown(
+        id='reason-dropdown',
+        options=[{'label': 'All Reasons', 'value': 'All Reasons'}] +
+                [{'label': i, 'value': i} for i in cancellation_reasons],
+        placeholder='Select a reason',
+        className='mb-2',
+    )
+
+    return html.Div(
+        children=[
+            dcc.Store(id='df_cancel_slice'),
+            html.H1('Cancellations'),
+            dbc.Row(
+                children=[
+                    dbc.Col(datepicker_range),
+                    dbc.Col(
+                        children=[
+                            html.Div(
+                                children='',
+                                id='cancel_total_box',
+                                className='pt-2',
+                            ),
+                        ],
+                        width='auto',
+                        className='border',
+                    ),
+                ],
+                className='mb-3 mr-1',
+            ),
+            dbc.Card(
+                children=[
+                    dbc.CardBody(
+                        children=[
+                            html.H4(
+                                children=[
+                                    "Cancellation Counts"
+                                ],
+                                className='card-title',
+                            ),
+                            html.P(
+                                children=[
+                                    "This table contains information for all \
+                                    cancelled subscriptions within the selected \
+                                    date range. It shows a list of each cancellation \
+                                    reason and the number of times it occured."
+                                ],
+                                className='card-text'
+                            ),
+                            dbc.Spinner(
+                                children=[
+                                    html.Div(
+                                        id="cancel_counts_container",
+                                    ),
+                                ],
+                                color='primary',
+                            ),
+                        ],
+                    ),
+                ],
+                color='secondary',
+                outline=True,
+                className='mb-3',
+            ),
+            dbc.Card(
+                children=[
+                    dbc.CardBody(
+                        children=[
+                            html.H4(
+                                children=[
+                                    'Cancellation Reason Comments'
+                                ],
+                                className='card-title',
+                            ),
+                            html.P(
+                                children=[
+                                    'All customers are required to enter a \
+                                    cancellation reason. They can optionally leave \
+                                    a cancellation comment. When provided, here are \
+                                    the cancellation reason comments.'
+                                ],
+                                className='card-text',
+                            ),
+                            dbc.Button(
+                                children=[
+                                    'Download CSV'
+                                ],
+                                id='btn_reason_csv',
+                                color='primary',
+                                className='mb-3',
+                            ),
+                            Download(
+                                id='download_reason_csv',
+                            ),
+                            html.Div(id="cancel_reasons_container"),
+                        ],
+                    ),
+                ],
+                color='secondary',
+                outline=True,
+                className='mb-3',
+            ),
+            dbc.Card(
+                children=[
+                    dbc.CardBody(
+                        children=[
+                            html.H4(
+                                children=[
+                                    'Customers by Cancellation Reason',
+                                ],
+                                className='card-title',
+                            ),
+                            html.P(
+                                children=[
+                                    'This table lists all of the customers that \
+                                    indicated a particular cancellation reason \
+                                    when they cancelled.'
+                                ],
+                                className='card-text',
+                            ),
+                            dbc.Button(
+                                children=[
+                                    'Download CSV'
+                                ],
+                                id='btn_reason_indiv_csv',
+                                color='primary',
+                                className='mb-3',
+                            ),
+                            Download(
+                                id='dl_reason_indiv_csv',
+                            ),
+                            dropdown,
+                            dbc.Spinner(
+                                children=[
+                                    html.Div(id="customers_by_reason_container"),
+                                ],
+                                color='primary',
+                            ),
+                        ],
+                    ),
+                ],
+                color='secondary',
+                outline=True,
+                className='mb-3',
+            ),
+        ]
+    )
 # CALLBACKS #
 
 # Helper functions
 
 
-def time_slice(start_date, end_date):
-    '''Filter DataFrame by date range
+def customers_by_reason(start_date, end_date, value):
+    '''Query the cancellations of one reason within the date range
 
     Keyword arguments:
     start_date -- beginning of date range
     end_date -- end of date range
+    value -- reason dropdown value ('All Reasons', a reason or None)
     '''
-    cancelled_at_min = start_date
-    cancelled_at_max = end_date
-    date_range = (df_cancel["cancelled_at"] > cancelled_at_min)\
-        & (df_cancel["cancelled_at"] < cancelled_at_max)
-    df_cancel_slice = df_cancel.loc[date_range]
-    return df_cancel_slice
-
-
-def df_non_empty(df_cancel_slice):
-    ''' Create DataFrame for non-empty reasons
-    '''
-    reasons_not_empty = (df_cancel_slice["cancellation_reason_comments"].notnull()) \
-        & (df_cancel_slice["cancellation_reason_comments"] != "")
-    df_cancel_reasons = df_cancel_slice.loc[reasons_not_empty]
-    df_cancel_reasons = df_cancel_reasons.sort_values(by="cancelled_at",
-                                                      ascending=False)
-    return df_cancel_reasons
+    if value is None:
+        return pd.DataFrame(columns=CANCEL_COLUMNS)
+    reason = None if value == 'All Reasons' else value
+    return fetch_cancellations(start_date, end_date, reason=reason)
 
 
 # CALLBACKS
@@ -243,8 +243,9 @@ def df_non_empty(df_cancel_slice):
 def df_store(start_date, end_date):
     ''' Update dcc.Store(id=df_cancel_slice)
     '''
-    df_cancel_slice = time_slice(start_date, end_date)
-    df_cancel_reasons = df_non_empty(df_cancel_slice=df_cancel_slice)
+    df_cancel_slice = fetch_cancellations(start_date, end_date)
+    df_cancel_reasons = fetch_cancellations(start_date, end_date,
+                                            with_comments=True)
     dataframes = {
         'df_cancel_slice': df_cancel_slice.to_dict('records'),
         'df_cancel_reasons': df_cancel_reasons.to_dict('records'),
@@ -378,27 +379,23 @@ def download_reason_csv(n_clicks, data):
         component_property='children',
     ),
     Input(
-        component_id='df_cancel_slice',
-        component_property='data',
+        component_id='date-picker-range',
+        component_property='start_date',
+    ),
+    Input(
+        component_id='date-picker-range',
+        component_property='end_date',
     ),
     Input(
         component_id='reason-dropdown',
         component_property='value',
     )
 )
-def update_customer_by_reason_table(data, value):
+def update_customer_by_reason_table(start_date, end_date, value):
     ''' Update customers by cancel reason table
     '''
-    df_cancel_slice = pd.DataFrame.from_dict(data['df_cancel_slice'])
-
     # Dataframe for customers by reason
-    if value == 'All Reasons':
-        df_cancel_customers = df_cancel_slice
-    else:
-        reason = df_cancel_slice["cancellation_reason"] == value
-        df_cancel_customers = df_cancel_slice.loc[reason]
-    df_cancel_customers = df_cancel_customers.sort_values(by="cancelled_at",
-                                                          ascending=False)
+    df_cancel_customers = customers_by_reason(start_date, end_date, value)
     df_cancel_customers.rename(
         columns={
             "email": "Email",
@@ -435,24 +432,20 @@ def update_customer_by_reason_table(data, value):
         component_property='value',
     ),
     State(
-        component_id='df_cancel_slice',
-        component_property='data',
+        component_id='date-picker-range',
+        component_property='start_date',
+    ),
+    State(
+        component_id='date-picker-range',
+        component_property='end_date',
     ),
     prevent_initial_call=True,
 )
-def download_reason_csv(n_clicks, value, data):
+def download_reason_csv(n_clicks, value, start_date, end_date):
     ''' Individual cancel reason download csv
     '''
-    df_cancel_slice = pd.DataFrame.from_dict(data['df_cancel_slice'])
-
     # Dataframe for customers by reason
-    if value == 'All Reasons':
-        df_cancel_customers = df_cancel_slice
-    else:
-        reason = df_cancel_slice["cancellation_reason"] == value
-        df_cancel_customers = df_cancel_slice.loc[reason]
-    df_cancel_customers = df_cancel_customers.sort_values(by="cancelled_at",
-                                                          ascending=False)
+    df_cancel_customers = customers_by_reason(start_date, end_date, value)
     df_cancel_customers.rename(
         columns={
             "email": "Email",
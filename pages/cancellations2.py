@@ -8,87 +8,83 @@ from dash.dependencies import Input, Output
 import dash_html_components as html
 import plotly.express as px
 
-import pandas as pd
-import psycopg2
-
-from dotenv import load_dotenv
-import os
-
-# Import .env variables #
-load_dotenv()  # take environment variables from .env
-DATABASE_URL = os.getenv('DATABASE_URL')
-# replace database_url prefix w/ 'postgresql' so sqlalchemy create_engine works
-HEROKU_DB_URL = DATABASE_URL.replace('postgres://', 'postgresql://')
-
 # Import Dash Instance #
 from app import app
 
+# Import local modules #
+from data_cache import refresher
+from data_cache.snapshots import (load_snapshot, refresh_snapshot,
+                                  snapshot_version)
+
 # DATAFRAMES #
-# Decrypt and load cancelled subscription dataframe
-# Load cancelled subscription dataframe from database #
-con = psycopg2.connect(DATABASE_URL)
-cur = con.cursor()
-query = f"""SELECT *
-            FROM cancel_db
-            """
-df_cancel = pd.read_sql(query, con)
-con.close()
-
-# restrict to after 06/01/2019
-df_cancel = df_cancel[df_cancel['cancelled_at'] > '2019-06-01']
-
-# Group by month and cancellation reason. Count emails.
-df_cancel_agg_grp = df_cancel.groupby(
-    [pd.Grouper(key='cancelled_at', freq='MS'), 'cancellation_reason'])
-df_cancel_agg = df_cancel_agg_grp.agg(cancel_count=('email', 'count'))
-df_cancel_agg.reset_index(inplace=True)
-df_cancel_agg['month_cancel_total'] = \
-    df_cancel_agg.groupby('cancelled_at')['cancel_count'].transform('sum')
-df_cancel_agg['percent_total'] = \
-    df_cancel_agg['cancel_count'] / df_cancel_agg['month_cancel_total']
 
-# LAYOUT #
 
-# Month Rangeslider
-month_list = df_cancel_agg['cancelled_at'].dt.strftime('%b %Y').unique()
-mark_style = {'font-family': 'Ubuntu', 'writing-mode': 'vertical-rl',
-              'white-space': 'nowrap'}
-month_slider = dcc.RangeSlider(
-    id='month_slider',
-    min=0,
-    max=len(month_list) - 1,
-    step=None,
-    marks={k: {'label': v, 'style': mark_style}
-           for (k, v) in enumerate(month_list)},
-    value=[0, len(month_list) - 1],
+def build_cancel_agg():
+    '''Return the monthly cancellation reason rollup maintained by
+    data_cache/update_cancel_table.py (one row per month and reason)
+    '''
+    df_cancel_agg = load_snapshot('cancel_monthly_reason')
+    df_cancel_agg = df_cancel_agg[df_cancel_agg['cancelled_at'] >= '2019-06-01']
+    return df_cancel_agg.sort_values(
+        ['cancelled_at', 'cancellation_reason'], ignore_index=True)
+
+
+refresher.register(
+    name='cancel_agg',
+    build=build_cancel_agg,
+    version=lambda: refresh_snapshot('cancel_monthly_reason'),
+    built_version=lambda: snapshot_version('cancel_monthly_reason'),
 )
 
+# LAYOUT #
+
 # Page Layout
-layout = html.Div(
-    children=[
-        dcc.Store(id='df_output'),
-        html.H1('Cancellations over Time'),
-        dbc.Row(
-            children=dbc.Col(
-                children=month_slider,
-                className='mb-4',
-                ),
-            className='border mb-3 pb-5 pt-3',
-        ),
-        dbc.Row(
-            children=dbc.Col(dcc.Graph(id='count_graph')),
-            className='border mb-3',
-        ),
-        dbc.Row(
-            children=dbc.Col(dcc.Graph(id='count_bar')),
-            className='border mb-3',
-        ),
-        dbc.Row(
-            children=dbc.Col(dcc.Graph(id='count_normalize_bar')),
-            className='border mb-3',
-        ),
-    ]
-)
+
+
+def layout():
+    ''' Build the page with a month slider over the current rollup
+    '''
+    df_cancel_agg = refresher.current('cancel_agg')
+
+    # Month Rangeslider
+    month_list = df_cancel_agg['cancelled_at'].dt.strftime('%b %Y').unique()
+    mark_style = {'font-family': 'Ubuntu', 'writing-mode': 'vertical-rl',
+                  'white-space': 'nowrap'}
+    month_slider = dcc.RangeSlider(
+        id='month_slider',
+        min=0,
+        max=len(month_list) - 1,
+        step=None,
+        marks={k: {'label': v, 'style': mark_style}
+               for (k, v) in enumerate(month_list)},
+        value=[0, len(month_list) - 1],
+    )
+
+    return html.Div(
+        children=[
+            dcc.Store(id='df_output'),
+            html.H1('Cancellations over Time'),
+            dbc.Row(
+                children=dbc.Col(
+                    children=month_slider,
+                    className='mb-4',
+                    ),
+                className='border mb-3 pb-5 pt-3',
+            ),
+            dbc.Row(
+                children=dbc.Col(dcc.Graph(id='count_graph')),
+                className='border mb-3',
+            ),
+            dbc.Row(
+                children=dbc.Col(dcc.Graph(id='count_bar')),
+                className='border mb-3',
+            ),
+            dbc.Row(
+                children=dbc.Col(dcc.Graph(id='count_normalize_bar')),
+                className='border mb-3',
+            ),
+        ]
+    )
 
 # CALLBACKS #
 
@@ -106,6 +102,7 @@ layout = html.Div(
 def df_store(value):
     ''' Update dcc.Store that all graphs access
     '''
+    df_cancel_agg = refresher.current('cancel_agg')
     months = df_cancel_agg['cancelled_at'].dt.strftime('%Y-%m-%d').unique()
     switcher = {k: v for k, v in enumerate(months)}
     cancelled_at_min = switcher.get(value[0])
@@ -15,15 +15,24 @@ import os
 from datetime import date, timedelta, datetime as dt
 import pandas as pd
 import pytz
-import requests
+import time
 
 # Import .env variables
 load_dotenv()  # take environment variables from .env
 RECHARGE_API_TOKEN = os.getenv('RECHARGE_API_TOKEN')
+# Seconds between refreshes of the queued charges
+CHARGE_REFRESH_SECONDS = float(os.getenv('CHARGE_REFRESH_SECONDS', 900))
 
 # Import Dash Instance #
 from app import app
 
+# Import local modules #
+from data_cache import refresher
+from data_cache.http_client import shared_session
+
+# Price exempt customer list
+exempt_path = 'data_cache/price_exempt_all.csv'
+
 # DATAFRAME #
 # Get upcoming charges
 
@@ -41,65 +50,88 @@ def get_recharge_charges(date_min, date_max, limit=250, status='QUEUED'):
     url = (f'https://api.rechargeapps.com/charges?limit={limit}&status={status}'
            f'&date_min={date_min}&date_max={date_max}')
 
-    response = requests.get(url, headers=headers)
+    response = shared_session().get(url, headers=headers)
     charge_data = response.json()['charges']
     return charge_data
 
 
-# get charges scheduled for tomorrow through 2 days out
-charge_get = get_recharge_charges(
-             date_min=(date.today() - timedelta(days=1)).strftime('%Y-%m-%d'),
-             date_max=(date.today() + timedelta(days=2)).strftime('%Y-%m-%d')
-)
+def build_exempt_que():
+    '''Return the queued charges of price exempt customers and the time
+    they were fetched
+    '''
+    # get charges scheduled for tomorrow through 2 days out
+    charge_get = get_recharge_charges(
+                 date_min=(date.today() - timedelta(days=1)).strftime('%Y-%m-%d'),
+                 date_max=(date.today() + timedelta(days=2)).strftime('%Y-%m-%d')
+    )
+
+    # Create df from data. Create empty df if no charges in que.
+    df_charge = pd.json_normalize(charge_get)
+    try:
+        df_charge = df_charge[['address_id', 'scheduled_at', 'total_price',
+                               'email', 'first_name', 'last_name']]
+    except KeyError:
+        df_charge = pd.DataFrame(columns=['address_id', 'scheduled_at',
+                                          'total_price', 'email', 'first_name',
+                                          'last_name'])
+
+    # Load price exempt customer df
+    df_exempt = pd.read_csv(exempt_path)
+
+    # Compare to price exempt list and keep only those customers
+    df_exempt_que = df_charge[df_charge['email'].isin(df_exempt['email'])]
+    df_exempt_que.columns = ['Address ID', 'Date Scheduled', 'Total Price', 'Customer Email', 'First Name', 'Last Name']
+
+    # update timestamp for eastern timezone
+    update_time = dt.now(pytz.timezone('America/New_York')).strftime('%b %d, %Y %I:%M%p')
+    return {'df_exempt_que': df_exempt_que, 'update_time': update_time}
+
+
+def exempt_que_version():
+    '''Change when the exempt list is rewritten and every
+    CHARGE_REFRESH_SECONDS, as the charge queue changes all day
+    '''
+    return (os.stat(exempt_path).st_mtime_ns,
+            int(time.time() // CHARGE_REFRESH_SECONDS))
 
-# Create df from data. Create empty df if no charges in que.
-df_charge = pd.json_normalize(charge_get)
-try:
-    df_charge = df_charge[['address_id', 'scheduled_at', 'total_price',
-                           'email', 'first_name', 'last_name']]
-except KeyError:
-    df_charge = pd.DataFrame(columns=['address_id', 'scheduled_at',
-                                      'total_price', 'email', 'first_name',
-                                      'last_name'])
-
-# Load price exempt customer df
-exempt_path = 'data_cache/price_exempt_all.csv'
-df_exempt = pd.read_csv(exempt_path)
 
-# Compare to price exempt list and keep only those customers
-df_exempt_que = df_charge[df_charge['email'].isin(df_exempt['email'])]
-df_exempt_que.columns = ['Address ID', 'Date Scheduled', 'Total Price', 'Customer Email', 'First Name', 'Last Name']
+refresher.register(
+    name='exempt_que',
+    build=build_exempt_que,
+    version=exempt_que_version,
+)
 
 
 # PAGE LAYOUT #
-# Layout components
-active_exempt_table = dbc.Table.from_dataframe(
-    df=df_exempt_que,
-    id='active_exempt',
-    striped=True,
-    bordered=True,
-    hover=True,
-    responsive=True,
-)
 
-markdown = dcc.Markdown('''
-    # Price Increase Exempt Customers
-    Customers with qued charges that are exempt from price increase.
-    ''')
-
-# update timestamp for eastern timezone
-#update_time = dt.now(pytz.timezone('America/New_York')).strftime('%c')
-update_time = dt.now(pytz.timezone('America/New_York')).strftime('%b %d, %Y %I:%M%p')
-#update_time = dt.now().strftime('%b %m, %Y %I:%M%p')
-
-# Layout
-layout = dbc.Container(
-    children=[
-        dbc.Row(dbc.Col(markdown)),
-        dbc.Row(dbc.Col(f'Last updated: {update_time}')),
-        dbc.Row(dbc.Col(active_exempt_table)),
-        html.Div(
-            id='page-1-content',
-        ),
-    ]
-)
+
+def layout():
+    ''' Build the page from the current exempt charge queue
+    '''
+    frames = refresher.current('exempt_que')
+
+    # Layout components
+    active_exempt_table = dbc.Table.from_dataframe(
+        df=frames['df_exempt_que'],
+        id='active_exempt',
+        striped=True,
+        bordered=True,
+        hover=True,
+        responsive=True,
+    )
+
+    markdown = dcc.Markdown('''
+        # Price Increase Exempt Customers
+        Customers with qued charges that are exempt from price increase.
+        ''')
+
+    return dbc.Container(
+        children=[
+            dbc.Row(dbc.Col(markdown)),
+            dbc.Row(dbc.Col(f'Last updated: {frames["update_time"]}')),
+            dbc.Row(dbc.Col(active_exempt_table)),
+            html.Div(
+                id='page-1-content',
+            ),
+        ]
+    )
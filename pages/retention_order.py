@@ -12,11 +12,8 @@ import dash_html_components as html
 from dash_table import DataTable
 from dash_table.Format import Format, Scheme
 
-from dotenv import load_dotenv
-import os
 import pandas as pd
 import plotly.express as px
-import psycopg2
 
 # Import Dash Instance #
 from app import app
@@ -24,241 +21,243 @@ from app import app
 # Import styles
 import assets.styles as style
 
-# Import .env variables #
-load_dotenv()  # take environment variables from .env
-DATABASE_URL = os.getenv('DATABASE_URL')
-# replace database_url prefix w/ 'postgresql' for consistency w/ sqlalchemy
-HEROKU_DB_URL = DATABASE_URL.replace('postgres://', 'postgresql://')
+# Import local modules #
+from data_cache import refresher
+from data_cache.snapshots import (load_snapshot, refresh_snapshot,
+                                  snapshot_version)
 
 ##############
 # DataFrames #
 ##############
 
-# Load active subscription orders from database #
-con = psycopg2.connect(DATABASE_URL)
-cur = con.cursor()
-query = f"""SELECT *
-            FROM active_sub
-            """
-df_orders_sub = pd.read_sql(query, con)
-con.close()
-
-# Groupby email and reset index. Aggregrate first order date and order count.
-df_orders_group = df_orders_sub.groupby('email', as_index=False)
-df_orders_agg = df_orders_group.agg(
-                  first_order_date=('created_at', 'min'),
-                  order_count=('order_number', 'count'),
-                )
-# create columns to track number of orders
-for number in range(2, 11):
-    order_number = number
-    df_orders_agg[f'{order_number} Order'] = (df_orders_agg['order_count']
-                                              >= order_number)
-
-
-def df_retain_orders_columns():
-    ''' create dictionary of order count column aggregrations
+
+def build_retention():
+    '''Return the retention frames of the page, built from the weekly
+    cohorts maintained by data_cache/update_active_table.py
     '''
-    agg_dict = {'email': 'count'}
-    for column_name in df_orders_agg.columns[3:]:
-        key = column_name
-        value = 'sum'
-        agg_dict[key] = value
-    return agg_dict
-
-# Resample into weeks to generate absolute counts #
-# subtract 6 days from first order date to align with Monday start
-
-
-df_orders_agg['first_order_date'] = (df_orders_agg['first_order_date']
-                                     - pd.to_timedelta(6, unit='d'))
-df_retain_orders = df_orders_agg.groupby(
-                    pd.Grouper(key='first_order_date', freq='W-MON')
-                    ).agg(df_retain_orders_columns())
-df_retain_orders.rename(
-    columns={'first_order_date': 'first_order_week'},
-    inplace=True
+    df_cohort = (load_snapshot('retention_weekly_cohort')
+                 .set_index('first_order_week')
+                 .sort_index())
+
+    # Customer count and customers reaching 2-10 subscription orders per week.
+    # Weeks without new customers are kept as empty rows.
+    df_retain_orders = df_cohort.rename(
+        columns={'customers': 'email',
+                 **{f'orders_{number}': f'{number} Order'
+                    for number in range(2, 11)}},
+    )
+    if not df_retain_orders.empty:
+        df_retain_orders = df_retain_orders.reindex(
+            pd.date_range(df_retain_orders.index.min(),
+                          df_retain_orders.index.max(),
+                          freq='W-MON'),
+            fill_value=0,
+        )
+    df_retain_orders.index.name = 'first_order_date'
+
+    # Divide by customers to generate percentages
+    df_retain_orders_percent = (df_retain_orders.iloc[:, 1:]
+                                .div(df_retain_orders['email'], axis=0))
+
+    # Format tables#
+
+    # Format for percentage table
+    df_retain_orders_percent_table = pd.concat(
+        objs=[df_retain_orders['email'], df_retain_orders_percent],
+        axis=1
+    )
+    df_retain_orders_percent_table.reset_index(inplace=True)
+    df_retain_orders_percent_table['first_order_date'] = \
+        df_retain_orders_percent_table['first_order_date'].dt.strftime('%Y-%m-%d')
+    df_retain_orders_percent_table.rename(
+        columns={
+            'email': 'Customers',
+            'first_order_date': 'First Order Week'
+        },
+        inplace=True,
     )
-# Divide by customers to generate percentages
-df_retain_orders_percent = (df_retain_orders.iloc[:, 1:]
-                            .div(df_retain_orders['email'], axis=0))
 
-# Format tables#
+    # Format for percentage graph
+    df_retain_graph = df_retain_orders_percent.transpose()
+
+    # Format for dbc.Table absolute
+    df_retain_orders.reset_index(inplace=True)
+    df_retain_orders['first_order_date'] = df_retain_orders['first_order_date'] \
+                                            .dt.strftime('%Y-%m-%d')
+    df_retain_orders.rename(
+        columns={
+            'email': 'Customers',
+            'first_order_date': 'First Order Week'
+        },
+        inplace=True,
+    )
+
+    return {
+        'df_retain_orders': df_retain_orders,
+        'df_retain_orders_percent_table': df_retain_orders_percent_table,
+        'df_retain_graph': df_retain_graph,
+    }
 
-# Format for percentage table
-df_retain_orders_percent_table = pd.concat(
-    objs=[df_retain_orders['email'], df_retain_orders_percent],
-    axis=1
-)
-df_retain_orders_percent_table.reset_index(inplace=True)
-df_retain_orders_percent_table['first_order_date'] = \
-    df_retain_orders_percent_table['first_order_date'].dt.strftime('%Y-%m-%d')
-df_retain_orders_percent_table.rename(
-    columns={
-        'email': 'Customers',
-        'first_order_date': 'First Order Week'
-    },
-    inplace=True,
-)
 
-# Format for percentage graph
-df_retain_graph = df_retain_orders_percent.transpose()
-
-# Format for dbc.Table absolute
-df_retain_orders.reset_index(inplace=True)
-df_retain_orders['first_order_date'] = df_retain_orders['first_order_date'] \
-                                        .dt.strftime('%Y-%m-%d')
-df_retain_orders.rename(
-    columns={
-        'email': 'Customers',
-        'first_order_date': 'First Order Week'
-    },
-    inplace=True,
+refresher.register(
+    name='retention',
+    build=build_retention,
+    version=lambda: refresh_snapshot('retention_weekly_cohort'),
+    built_version=lambda: snapshot_version('retention_weekly_cohort'),
 )
 
 ###############
 # Page Layout #
 ###############
 
-# layout components #
-retention_trace = px.line(
-    data_frame=df_retain_graph,
-)
 
-# DataTable #
-# Table columns
-retention_table_percent_columns = \
-    [{'name': i, 'id': i} for i in df_retain_orders_percent_table.columns[0:2]] + \
-    [{'name': i, 'id': i, 'type': 'numeric',
-      'format': Format(precision=0, scheme=Scheme.percentage)} \
-     for i in df_retain_orders_percent_table.columns[2:]]
-
-# conditional styling
-conditional_style_1 = [
-    {
-        'if': {
-            'filter_query': '{{{col}}} >= .8 && {{{col}}} <= 1'.format(col=col),
-            'column_id': col
-        },
-        'backgroundColor': '#a63603',
-        'color': 'white'
-    } for col in df_retain_orders_percent_table.columns
-]
-conditional_style_2 = [
-    {
-        'if': {
-            'filter_query': '{{{col}}} >= .6 && {{{col}}} <.8'.format(col=col),
-            'column_id': col
-        },
-        'backgroundColor': '#e6550d',
-        'color': 'white'
-    } for col in df_retain_orders_percent_table.columns
-]
-conditional_style_3 = [
-    {
-        'if': {
-            'filter_query': '{{{col}}} >= .4 && {{{col}}} <.6'.format(col=col),
-            'column_id': col
-        },
-        'backgroundColor': '#fd8d3c',
-        'color': 'white'
-    } for col in df_retain_orders_percent_table.columns
-]
-conditional_style_4 = [
-    {
-        'if': {
-            'filter_query': '{{{col}}} >= .2 && {{{col}}} <.4'.format(col=col),
-            'column_id': col
-        },
-        'backgroundColor': '#fdbe85',
-        'color': 'black'
-    } for col in df_retain_orders_percent_table.columns
-]
-conditional_style_5 = [
-    {
-        'if': {
-            'filter_query': '{{{col}}} >= .01 && {{{col}}} <.2'.format(col=col),
-            'column_id': col
-        },
-        'backgroundColor': '#feedde',
-        'color': 'black'
-    } for col in df_retain_orders_percent_table.columns
-]
-conditional_style_all = conditional_style_1 + conditional_style_2 + \
-    conditional_style_3 + conditional_style_4 + conditional_style_5
-
-
-# Table setup
-retention_table_percent = DataTable(
-    id='retention_table_percent',
-    columns=retention_table_percent_columns,
-    data=df_retain_orders_percent_table.to_dict('records'),
-    page_size=26,
-    style_cell=style.dt_cell,
-    filter_action='native',
-    style_data_conditional=conditional_style_all,
-)
+def layout():
+    ''' Build the page from the current retention frames
+    '''
+    frames = refresher.current('retention')
+    df_retain_orders = frames['df_retain_orders']
+    df_retain_orders_percent_table = frames['df_retain_orders_percent_table']
+    df_retain_graph = frames['df_retain_graph']
+
+    # layout components #
+    retention_trace = px.line(
+        data_frame=df_retain_graph,
+    )
 
-table_descrip = dcc.Markdown('''
-### Weekly Cohort Retention - Percentage
-
-Table shows percentage of each cohort that has placed X number of subscription
-orders.
-
-*Example:* 46 customers placed their first subscription order in the week of
-2021-06-21 (Mon - Sun). 78% placed a 2nd subscription order, 43% placed a 3rd
-subscription order, etc.
-
-**Date Filtering** -
-Rows can be filtered by date. Enter search string and press enter to filter.
-To reset, delete search string and press enter.
-
-*Examples:*
-- "2021-07-04" = Select the 2021-07-04 row.
-- ">= 2021-06-13" = Select rows including and after 2021-06-13.
-- "<2021-07-04" = Select rows before 2021-07-04.
-
-''')
-
-# Layout #
-layout = dbc.Container(
-    children=[
-        dbc.Row(
-            children=[
-                dbc.Col(html.H1("Retention By Order Count")),
-            ],
-            className='',
-        ),
-        dbc.Row(
-            children=[
-                dbc.Col(
-                    children=[
-                        table_descrip,
-                    ],
-                ),
-            ],
-            className='border mb-3 py-3',
-        ),
-        dbc.Row(
-            children=[
-                dbc.Col(
-                    children=[
-                        retention_table_percent,
-                    ],
-                ),
-            ],
-            className='mb-3',
-        ),
-        dcc.Graph(
-            figure=retention_trace,
-        ),
-        dbc.Table.from_dataframe(
-            df_retain_orders,
-            striped=True,
-            bordered=True,
-            hover=True),
+    # DataTable #
+    # Table columns
+    retention_table_percent_columns = \
+        [{'name': i, 'id': i} for i in df_retain_orders_percent_table.columns[0:2]] + \
+        [{'name': i, 'id': i, 'type': 'numeric',
+          'format': Format(precision=0, scheme=Scheme.percentage)} \
+         for i in df_retain_orders_percent_table.columns[2:]]
+
+    # conditional styling
+    conditional_style_1 = [
+        {
+            'if': {
+                'filter_query': '{{{col}}} >= .8 && {{{col}}} <= 1'.format(col=col),
+                'column_id': col
+            },
+            'backgroundColor': '#a63603',
+            'color': 'white'
+        } for col in df_retain_orders_percent_table.columns
     ]
-)
+    conditional_style_2 = [
+        {
+            'if': {
+                'filter_query': '{{{col}}} >= .6 && {{{col}}} <.8'.format(col=col),
+                'column_id': col
+            },
+            'backgroundColor': '#e6550d',
+            'color': 'white'
+        } for col in df_retain_orders_percent_table.columns
+    ]
+    conditional_style_3 = [
+        {
+            'if': {
+                'filter_query': '{{{col}}} >= .4 && {{{col}}} <.6'.format(col=col),
+                'column_id': col
+            },
+            'backgroundColor': '#fd8d3c',
+            'color': 'white'
+        } for col in df_retain_orders_percent_table.columns
+    ]
+    conditional_style_4 = [
+        {
+            'if': {
+                'filter_query': '{{{col}}} >= .2 && {{{col}}} <.4'.format(col=col),
+                'column_id': col
+            },
+            'backgroundColor': '#fdbe85',
+            'color': 'black'
+        } for col in df_retain_orders_percent_table.columns
+    ]
+    conditional_style_5 = [
+        {
+            'if': {
+                'filter_query': '{{{col}}} >= .01 && {{{col}}} <.2'.format(col=col),
+                'column_id': col
+            },
+            'backgroundColor': '#feedde',
+            'color': 'black'
+        } for col in df_retain_orders_percent_table.columns
+    ]
+    conditional_style_all = conditional_style_1 + conditional_style_2 + \
+        conditional_style_3 + conditional_style_4 + conditional_style_5
+
+
+    # Table setup
+    retention_table_percent = DataTable(
+        id='retention_table_percent',
+        columns=retention_table_percent_columns,
+        data=df_retain_orders_percent_table.to_dict('records'),
+        page_size=26,
+        style_cell=style.dt_cell,
+        filter_action='native',
+        style_data_conditional=conditional_style_all,
+    )
+
+    table_descrip = dcc.Markdown('''
+    ### Weekly Cohort Retention - Percentage
+
+    Table shows percentage of each cohort that has placed X number of subscription
+    orders.
+
+    *Example:* 46 customers placed their first subscription order in the week of
+    2021-06-21 (Mon - Sun). 78% placed a 2nd subscription order, 43% placed a 3rd
+    subscription order, etc.
+
+    **Date Filtering** -
+    Rows can be filtered by date. Enter search string and press enter to filter.
+    To reset, delete search string and press enter.
+
+    *Examples:*
+    - "2021-07-04" = Select the 2021-07-04 row.
+    - ">= 2021-06-13" = Select rows including and after 2021-06-13.
+    - "<2021-07-04" = Select rows before 2021-07-04.
+
+    ''')
+
+    return dbc.Container(
+        children=[
+            dbc.Row(
+                children=[
+                    dbc.Col(html.H1("Retention By Order Count")),
+                ],
+                className='',
+            ),
+            dbc.Row(
+                children=[
+                    dbc.Col(
+                        children=[
+                            table_descrip,
+                        ],
+                    ),
+                ],
+                className='border mb-3 py-3',
+            ),
+            dbc.Row(
+                children=[
+                    dbc.Col(
+                        children=[
+                            retention_table_percent,
+                        ],
+                    ),
+                ],
+                className='mb-3',
+            ),
+            dcc.Graph(
+                figure=retention_trace,
+            ),
+            dbc.Table.from_dataframe(
+                df_retain_orders,
+                striped=True,
+                bordered=True,
+                hover=True),
+        ]
+    )
+
 
 # Page 1 Callbacks #
 '''
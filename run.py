@@ -1,5 +1,7 @@
 # Dash development server run file
 import index
+from data_cache import refresher
 
 if __name__ == '__main__':
+    refresher.start_refresher()
     index.app.run_server(debug=True)
@@ -1,20 +1,31 @@
 """functions to back up Shopify data"""
 # package imports
-import json
-import pandas as pd
-import requests
 import time
 
 # local imports
-from config import settings
+from data_cache.config import SHOPIFY_API_URL
+from data_cache.http_client import shared_session
+from data_cache.pagination import iter_page_cursors
+from data_cache.rate_limit import shopify_limiter
+from shopify_archive.backup_io import (BACKUP_WRITERS, load_checkpoint,
+                                       save_checkpoint)
+from shopify_archive.config import settings
 
 
-def list_endpoint_records(resource):
-    """List all records from endpoint and store as JSON
+def list_endpoint_records(resource, limiter=None, backup_format="json"):
+    """List all records from endpoint and store them as a backup
+
+    Pages are written to the backup as they arrive, so only one page
+    of records is held in memory. After every page the next page URL and
+    the backup file position are saved to a checkpoint, so an interrupted
+    backup continues from its last page when run again. Returns a
+    dictionary of pages, records, seconds taken and whether the backup
+    was skipped because its checkpoint is already done.
 
     Keyword arguments:
-    endpoint - the target Shopify endpoint
-    resource_name - resource is json key name
+    resource - the target Shopify resource; also the json key name
+    limiter - shared rate_limit.BucketRateLimiter (default a new Shopify limiter)
+    backup_format - "json" array, gzip "jsonl" or month-partitioned "parquet"
 
     Reference:
     https://shopify.dev/docs/api/admin-rest
@@ -28,28 +39,72 @@ def list_endpoint_records(resource):
         "limit": 250,
         #"created_at_min": "2023-01-18"
     }
-    shop = "the-good-kitchen-esc.myshopify.com"
-    url = f"https://{shop}/admin/api/2023-01/{resource}.json"
-
-    # Access and store first page of results
-    session = requests.Session()
-    print(f"Get Page 1 of {resource}")
-    response = session.get(url, headers=headers, params=payload)
-    response_data = response.json()
-    all_records = response_data[resource]
-
-    # While Next Link is present, access and store next page
-    count = 1
-    while "next" in response.links:
-        next_url = response.links["next"]["url"]
-        response = session.get(next_url, headers=headers)
-        count += 1
-        print(f"Get Page {count} of {resource}")
-        response_data = response.json()
-        all_records.extend(response_data[resource])
-        # Sleep to avoid rate limit if approach bucket size
-        if response.headers["X-Shopify-Shop-Api-Call-Limit"] == "79/80":
-            time.sleep(0.25)
-    backup_path = f"backups/{resource}.json"
-    with open(backup_path, "w") as f:
-        json.dump(all_records, f)
+    url = f"{SHOPIFY_API_URL}/admin/api/2023-01/{resource}.json"
+
+    if limiter is None:
+        limiter = shopify_limiter()
+
+    # Continue from the checkpoint of an interrupted backup in this format
+    checkpoint = load_checkpoint(resource)
+    if checkpoint is not None and checkpoint["format"] != backup_format:
+        checkpoint = None
+    if checkpoint is not None and checkpoint["done"]:
+        print(f"{resource}: already backed up, skipping")
+        return {
+            "pages": checkpoint["pages"],
+            "records": checkpoint["records"],
+            "seconds": 0,
+            "skipped": True,
+        }
+    if checkpoint is None:
+        checkpoint = {
+            "format": backup_format,
+            "next_url": None,
+            "pages": 0,
+            "records": 0,
+            "position": None,
+            "done": False,
+        }
+        params = payload
+    else:
+        print(f"{resource}: resuming after page {checkpoint['pages']}")
+        url, params = checkpoint["next_url"], None
+
+    # Stream each page of results into the backup writer
+    writer = BACKUP_WRITERS[backup_format](resource, checkpoint["position"])
+    start = time.monotonic()
+    record_count = 0
+    session = shared_session()
+    if url is None:
+        # The last page was saved but the backup was not closed yet
+        pages = []
+    else:
+        pages = iter_page_cursors(
+            session=session,
+            url=url,
+            key=resource,
+            limiter=limiter,
+            headers=headers,
+            params=params,
+        )
+    for records, next_url in pages:
+        writer.write_page(records)
+        record_count += len(records)
+        checkpoint["pages"] += 1
+        checkpoint["records"] += len(records)
+        checkpoint["next_url"] = next_url
+        checkpoint["position"] = writer.position()
+        save_checkpoint(resource, checkpoint)
+        elapsed = time.monotonic() - start
+        print(f"{resource}: page {checkpoint['pages']}, "
+              f"{checkpoint['records']} records, "
+              f"{record_count / elapsed:.0f} records/s")
+    writer.close()
+    checkpoint["done"] = True
+    save_checkpoint(resource, checkpoint)
+    return {
+        "pages": checkpoint["pages"],
+        "records": checkpoint["records"],
+        "seconds": time.monotonic() - start,
+        "skipped": False,
+    }
@@ -0,0 +1,318 @@
+"""write and read Shopify backups one page at a time"""
+# package imports
+import glob
+import gzip
+import json
+import os
+import pandas as pd
+import pyarrow as pa
+import pyarrow.parquet as pq
+import shutil
+
+BACKUP_DIR = os.path.join(os.path.dirname(__file__), "backups")
+BACKUP_FORMATS = ["json", "jsonl", "parquet"]
+
+
+def backup_path(resource, backup_format):
+    """Return the file (or partition directory) of a resource backup
+
+    Keyword arguments:
+    resource - Shopify resource name
+    backup_format - one of BACKUP_FORMATS
+    """
+    names = {
+        "json": f"{resource}.json",
+        "jsonl": f"{resource}.jsonl.gz",
+        "parquet": resource,
+    }
+    return os.path.join(BACKUP_DIR, names[backup_format])
+
+
+def remove_other_formats(resource, backup_format):
+    """Remove the backups of a resource in every format but backup_format
+
+    Called when a new backup starts, so read_backup never finds an older
+    backup in another format next to it.
+
+    Keyword arguments:
+    resource - Shopify resource name
+    backup_format - format of the backup being written
+    """
+    for other_format in BACKUP_FORMATS:
+        path = backup_path(resource, other_format)
+        if other_format == backup_format:
+            continue
+        if os.path.isdir(path):
+            shutil.rmtree(path)
+        elif os.path.exists(path):
+            os.remove(path)
+
+
+def checkpoint_path(resource):
+    """Return the checkpoint file of a resource backup"""
+    return os.path.join(BACKUP_DIR, f"{resource}.checkpoint.json")
+
+
+def load_checkpoint(resource):
+    """Return the stored checkpoint of a resource backup, or None"""
+    try:
+        with open(checkpoint_path(resource)) as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return None
+
+
+def save_checkpoint(resource, checkpoint):
+    """Atomically replace the checkpoint of a resource backup
+
+    Keyword arguments:
+    resource - Shopify resource name
+    checkpoint - dictionary of format, next_url, pages, records, position
+                 and done
+    """
+    path = checkpoint_path(resource)
+    with open(path + ".tmp", "w") as f:
+        json.dump(checkpoint, f)
+    os.replace(path + ".tmp", path)
+
+
+def clear_checkpoints(resources):
+    """Remove the checkpoints of finished resource backups"""
+    for resource in resources:
+        if os.path.exists(checkpoint_path(resource)):
+            os.remove(checkpoint_path(resource))
+
+
+def record_month(record):
+    """Return the YYYY-MM partition of a record from its created_at"""
+    created_at = record.get("created_at")
+    return created_at[:7] if created_at else "unknown"
+
+
+class JsonArrayWriter:
+    """Stream records into one JSON array file (the original format)
+
+    Every writer takes resume, the position() of its last checkpointed
+    page, and continues after that page instead of starting a new backup.
+    """
+
+    def __init__(self, resource, resume=None):
+        path = backup_path(resource, "json")
+        if resume is None:
+            remove_other_formats(resource, "json")
+            self.file = open(path, "w")
+            self.file.write("[")
+        else:
+            # Drop anything written after the checkpointed page
+            self.file = open(path, "r+")
+            self.file.truncate(resume)
+            self.file.seek(resume)
+        self.first_record = self.file.tell() <= 1
+
+    def position(self):
+        """Return the resume position after the last written page"""
+        self.file.flush()
+        return self.file.tell()
+
+    def write_page(self, records):
+        for record in records:
+            if not self.first_record:
+                self.file.write(", ")
+            json.dump(record, self.file)
+            self.first_record = False
+
+    def close(self):
+        self.file.write("]")
+        self.file.close()
+
+
+class JsonlGzipWriter:
+    """Append each page to a gzip JSONL file as its own gzip member
+
+    Concatenated gzip members read back as one stream, and every page is
+    complete on disk as soon as write_page returns.
+    """
+
+    def __init__(self, resource, resume=None):
+        self.path = backup_path(resource, "jsonl")
+        if resume is None:
+            remove_other_formats(resource, "jsonl")
+        with open(self.path, "r+b" if resume is not None else "wb") as f:
+            f.truncate(resume or 0)
+
+    def position(self):
+        """Return the resume position after the last written page"""
+        return os.path.getsize(self.path)
+
+    def write_page(self, records):
+        with gzip.open(self.path, "ab") as f:
+            for record in records:
+                f.write(json.dumps(record).encode() + b"\n")
+
+    def close(self):
+        pass
+
+
+def arrow_column(values):
+    """Return values as an Arrow array, and whether it holds JSON strings
+
+    Scalar values keep their native Arrow type. Nested values (lists and
+    dicts such as line_items) and columns mixing types are JSON-encoded.
+
+    Keyword arguments:
+    values - list of the values of one column, None where missing
+    """
+    if not any(isinstance(value, (dict, list)) for value in values):
+        try:
+            return pa.array(values), False
+        except (pa.ArrowInvalid, pa.ArrowTypeError):
+            pass
+    encoded = [None if value is None else json.dumps(value)
+               for value in values]
+    return pa.array(encoded, type=pa.string()), True
+
+
+class ParquetMonthWriter:
+    """Write each page as Parquet files partitioned by created_at month
+
+    Files land in {resource}/month=YYYY-MM/part-NNNNN.parquet. Scalar
+    columns are stored with native types. Nested fields (line_items,
+    addresses) are JSON-encoded, and their names are listed under the
+    json_columns key of the file metadata, so they round-trip exactly.
+    """
+
+    def __init__(self, resource, resume=None):
+        self.path = backup_path(resource, "parquet")
+        if resume is None:
+            remove_other_formats(resource, "parquet")
+        self.page = resume or 0
+        # Remove parts of an earlier backup (or written after the checkpoint)
+        for old_file in glob.glob(os.path.join(self.path, "*", "*.parquet")):
+            part = os.path.basename(old_file)[len("part-"):-len(".parquet")]
+            if not part.isdigit() or int(part) > self.page:
+                os.remove(old_file)
+
+    def position(self):
+        """Return the resume position after the last written page"""
+        return self.page
+
+    def write_page(self, records):
+        self.page += 1
+        months = {}
+        for record in records:
+            months.setdefault(record_month(record), []).append(record)
+        for month, month_records in months.items():
+            columns = sorted({key for record in month_records for key in record})
+            arrays, json_columns = [], []
+            for column in columns:
+                array, encoded = arrow_column(
+                    [record.get(column) for record in month_records])
+                arrays.append(array)
+                if encoded:
+                    json_columns.append(column)
+            table = pa.Table.from_arrays(
+                arrays,
+                names=columns,
+                metadata={"json_columns": json.dumps(json_columns)},
+            )
+            month_dir = os.path.join(self.path, f"month={month}")
+            os.makedirs(month_dir, exist_ok=True)
+            pq.write_table(
+                table,
+                os.path.join(month_dir, f"part-{self.page:05d}.parquet"),
+            )
+
+    def close(self):
+        pass
+
+
+BACKUP_WRITERS = {
+    "json": JsonArrayWriter,
+    "jsonl": JsonlGzipWriter,
+    "parquet": ParquetMonthWriter,
+}
+
+
+def backup_format_of(resource):
+    """Return the format of the stored backup of a resource
+
+    A new backup removes the other formats, so only one is on disk. Of
+    backups left by older versions, the most recently modified one wins.
+    """
+    stored = [backup_format for backup_format in BACKUP_FORMATS
+              if os.path.exists(backup_path(resource, backup_format))]
+    if not stored:
+        raise FileNotFoundError(f"No backup of {resource} in {BACKUP_DIR}")
+    return max(stored, key=lambda backup_format: os.path.getmtime(
+        backup_path(resource, backup_format)))
+
+
+def read_backup(resource, months=None, columns=None, backup_format=None):
+    """Load a resource backup into a DataFrame
+
+    Parquet backups only read the requested months and columns. Gzip JSONL
+    and JSON backups are read line by line or whole and then filtered.
+
+    Keyword arguments:
+    resource - Shopify resource name
+    months - list of 'YYYY-MM' created_at months to load (default all)
+    columns - list of record keys to load (default all)
+    backup_format - one of BACKUP_FORMATS (default the stored one)
+    """
+    if backup_format is None:
+        backup_format = backup_format_of(resource)
+    if backup_format == "parquet":
+        return read_parquet_backup(backup_path(resource, "parquet"),
+                                   months, columns)
+    if backup_format == "jsonl":
+        with gzip.open(backup_path(resource, "jsonl"), "rt") as f:
+            records = (json.loads(line) for line in f)
+            df = pd.DataFrame(
+                record for record in records
+                if months is None or record_month(record) in months
+            )
+    else:
+        df = pd.read_json(backup_path(resource, "json"))
+        if months is not None:
+            df = df[df["created_at"].astype(str).str[:7].isin(months)]
+    if columns is not None:
+        df = df.reindex(columns=columns)
+    return df
+
+
+def read_parquet_backup(path, months=None, columns=None):
+    """Read selected month partitions and columns of a Parquet backup
+
+    Keyword arguments:
+    path - partition directory of the resource
+    months - list of 'YYYY-MM' months to load (default all)
+    columns - list of record keys to load (default all)
+    """
+    frames = []
+    for month_dir in sorted(glob.glob(os.path.join(path, "month=*"))):
+        month = os.path.basename(month_dir)[len("month="):]
+        if months is not None and month not in months:
+            continue
+        for part in sorted(glob.glob(os.path.join(month_dir, "*.parquet"))):
+            schema = pq.ParquetFile(part).schema_arrow
+            available = schema.names
+            if columns is not None:
+                available = [column for column in columns
+                             if column in available]
+            # Files written before native types JSON-encoded every column
+            metadata = schema.metadata or {}
+            if b"json_columns" in metadata:
+                json_columns = json.loads(metadata[b"json_columns"])
+            else:
+                json_columns = schema.names
+            df = pq.read_table(part, columns=available).to_pandas()
+            for column in df.columns:
+                if column in json_columns:
+                    df[column] = df[column].map(json.loads, na_action="ignore")
+            frames.append(df)
+    if not frames:
+        return pd.DataFrame(columns=columns)
+    df = pd.concat(frames, ignore_index=True)
+    if columns is not None:
+        df = df.reindex(columns=columns)
+    return df
@@ -1,6 +1,6 @@
 """load backup into Dataframe and view"""
 
-import pandas as pd
+from shopify_archive.backup_io import read_backup
 
-df = pd.read_json("customers.json")
-df.to_csv(f'customers.csv', index=False)
\ No newline at end of file
+df = read_backup("customers")
+df.to_csv(f'customers.csv', index=False)
@@ -1,11 +1,60 @@
-"""Run individual endpoint backups"""
+"""Run endpoint backups concurrently under one Shopify rate limit"""
 # package imports
+import argparse
+from concurrent.futures import ThreadPoolExecutor
+import sys
+
 # local imports
-from backup_funcs import list_endpoint_records
+from data_cache.rate_limit import shopify_limiter
+from shopify_archive.backup_funcs import list_endpoint_records
+from shopify_archive.backup_io import BACKUP_FORMATS, clear_checkpoints
 
 
 # Define from which endpoints to extract data
 resources = ["customers", "price_rules", "orders", "collects", "products"]
 
-for resource in resources:
-    list_endpoint_records(resource=resource)
\ No newline at end of file
+parser = argparse.ArgumentParser(description="Back up Shopify resources")
+parser.add_argument(
+    "--format",
+    choices=BACKUP_FORMATS,
+    default="json",
+    help="JSON array, gzip JSONL or Parquet partitioned by month",
+)
+args = parser.parse_args()
+
+# Every resource runs in its own thread; the shared limiter keeps their
+# combined calls inside the Shopify bucket
+limiter = shopify_limiter()
+with ThreadPoolExecutor(max_workers=len(resources)) as executor:
+    futures = {
+        resource: executor.submit(
+            list_endpoint_records,
+            resource=resource,
+            limiter=limiter,
+            backup_format=args.format,
+        )
+        for resource in resources
+    }
+
+# Summarize each resource independently; one failure does not stop the rest
+failed = []
+for resource, future in futures.items():
+    try:
+        stats = future.result()
+    except Exception as error:
+        failed.append(resource)
+        print(f"{resource}: FAILED - {error!r}")
+        continue
+    if stats["skipped"]:
+        print(f"{resource}: {stats['records']} records already backed up")
+        continue
+    rate = stats["records"] / stats["seconds"] if stats["seconds"] else 0
+    print(f"{resource}: {stats['pages']} pages, {stats['records']} records "
+          f"in {stats['seconds']:.0f}s ({rate:.0f} records/s)")
+
+if failed:
+    sys.exit(f"Backups failed: {', '.join(failed)}; "
+             f"run again to resume from their checkpoints")
+
+# Every resource finished, so the next run starts a fresh backup
+clear_checkpoints(resources)
@@ -0,0 +1,35 @@
+# conftest.py
+# Shared fixtures: a local data_cache.mock_api server for the fetcher tests.
+
+###########
+# IMPORTS #
+###########
+
+# Import Packages #
+import threading
+
+import pytest
+
+# Import local modules #
+from data_cache.mock_api import make_mock_server
+
+
+@pytest.fixture
+def mock_api():
+    '''Return a function that starts a mock API server and returns it
+
+    Keyword arguments of the function are passed to make_mock_server. The
+    servers are shut down when the test ends.
+    '''
+    servers = []
+
+    def start(**kwargs):
+        server = make_mock_server(port=0, **kwargs)
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        servers.append(server)
+        return server
+
+    yield start
+    for server in servers:
+        server.shutdown()
+        server.server_close()
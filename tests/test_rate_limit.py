@@ -0,0 +1,108 @@
+# test_rate_limit.py
+# The limiters must pace requests by the call limit headers, back off on
+# 429s and keep threads that share them inside the API's leak rate.
+
+###########
+# IMPORTS #
+###########
+
+# Import Packages #
+from concurrent.futures import ThreadPoolExecutor
+import time
+
+import pytest
+import requests
+
+# Import local modules #
+from data_cache.mock_api import LeakyBucket
+from data_cache.rate_limit import (BucketRateLimiter, RateLimiter,
+                                   parse_call_limit, retry_after)
+
+HEADER = 'X-Shopify-Shop-Api-Call-Limit'
+
+
+def orders_url(server):
+    return (f'http://127.0.0.1:{server.server_address[1]}'
+            f'/admin/api/2021-07/orders.json?limit=1')
+
+
+def test_parse_call_limit():
+    assert parse_call_limit('39/40') == (39, 40)
+    assert parse_call_limit(None) is None
+    assert parse_call_limit('garbage') is None
+
+
+def test_retry_after():
+    response = requests.Response()
+    assert retry_after(response) is None
+    response.headers['Retry-After'] = '2.5'
+    assert retry_after(response) == 2.5
+    response.headers['Retry-After'] = 'soon'
+    assert retry_after(response) is None
+
+
+@pytest.mark.parametrize('limiter', [
+    RateLimiter(1000),
+    BucketRateLimiter(HEADER, leak_rate=10, capacity=10, headroom=0),
+])
+def test_penalize_holds_back_the_next_request(limiter):
+    limiter.penalize(0.5)
+    assert limiter.wait() == pytest.approx(0.5, abs=0.05)
+
+
+def test_bucket_limiter_follows_the_call_limit_header(mock_api):
+    server = mock_api(latency=0)
+    # Another client already used most of the bucket
+    server.shopify_bucket = LeakyBucket(10, 20)
+    server.shopify_bucket.level = 9
+    # The limiter starts with a wrong capacity and learns it from the header
+    limiter = BucketRateLimiter(HEADER, leak_rate=20, capacity=100)
+    session = requests.Session()
+
+    started = time.monotonic()
+    for _ in range(30):
+        assert limiter.get(session, orders_url(server)).status_code == 200
+    seconds = time.monotonic() - started
+
+    assert limiter.capacity == 10
+    assert limiter.retries == 0
+    # 30 calls into a bucket with one free call, draining 20 per second
+    assert seconds >= (30 - 1) / 20 * 0.9
+
+
+def test_429_is_retried_after_retry_after(mock_api):
+    server = mock_api(latency=0)
+    server.shopify_bucket = LeakyBucket(2, 2)
+    # A fixed budget does not read the bucket header, so it hits the limit
+    limiter = RateLimiter(1000, backoff=5)
+    session = requests.Session()
+
+    started = time.monotonic()
+    for _ in range(3):
+        assert limiter.get(session, orders_url(server)).status_code == 200
+    seconds = time.monotonic() - started
+
+    assert limiter.retries == 1
+    # The mock sends Retry-After: 1.0, which replaces the 5 second backoff
+    assert 1 <= seconds < 5
+
+
+def test_threads_sharing_a_limiter_stay_inside_the_leak_rate(mock_api):
+    server = mock_api(latency=0)
+    server.shopify_bucket = LeakyBucket(10, 40)
+    limiter = BucketRateLimiter(HEADER, leak_rate=40, capacity=10)
+    session = requests.Session()
+
+    def fetch(_):
+        return limiter.get(session, orders_url(server)).status_code
+
+    started = time.monotonic()
+    with ThreadPoolExecutor(max_workers=4) as executor:
+        statuses = list(executor.map(fetch, range(60)))
+    seconds = time.monotonic() - started
+
+    assert statuses == [200] * 60
+    # No call was rejected by the server bucket
+    assert limiter.retries == 0
+    # Beyond the free bucket, calls go out no faster than the leak rate
+    assert seconds >= (60 - limiter.capacity) / 40 * 0.9
@@ -0,0 +1,78 @@
+# test_shopify_bulk.py
+# The GraphQL bulk export must build the same active_sub rows as the REST
+# Order API.
+
+###########
+# IMPORTS #
+###########
+
+# Import Packages #
+import json
+import os
+
+import pandas as pd
+import pytest
+
+# Import local modules #
+from data_cache import shopify_bulk, update_active_table
+from data_cache.mock_api import MockData
+from data_cache.shopify_bulk import get_shopify_bulk_orders, iter_bulk_orders
+from data_cache.update_active_table import (generate_active_order_df,
+                                            get_shopify_order_api)
+
+FIXTURE_DIR = os.path.join(os.path.dirname(__file__), 'fixtures')
+# bulk_orders.jsonl was recorded from MockData(12, 12, 5)
+FIXTURE_ORDERS = 12
+
+
+def read_fixture():
+    with open(os.path.join(FIXTURE_DIR, 'bulk_orders.jsonl')) as f:
+        return [json.loads(line) for line in f]
+
+
+def active_rows(pages):
+    '''Return the active_sub frame of pages of orders, in a fixed order'''
+    frames = [generate_active_order_df(records) for records in pages]
+    df = pd.concat(frames, ignore_index=True)
+    return df.sort_values(['order_number', 'sku']).reset_index(drop=True)
+
+
+def test_bulk_fixture_rebuilds_rest_orders():
+    orders = list(iter_bulk_orders(read_fixture()))
+    data = MockData(FIXTURE_ORDERS, FIXTURE_ORDERS, 5)
+    rest_orders = [data.order(index) for index in range(FIXTURE_ORDERS)]
+
+    assert [order['order_number'] for order in orders] == \
+        [order['order_number'] for order in rest_orders]
+    assert [len(order['line_items']) for order in orders] == \
+        [len(order['line_items']) for order in rest_orders]
+    # Timestamps are moved from UTC to the shop's offset, DST included
+    assert orders[1]['created_at'] == '2019-03-23T00:00:00-04:00'
+    assert orders[5]['created_at'] == '2020-02-10T15:00:00-05:00'
+    pd.testing.assert_frame_equal(active_rows([orders]),
+                                  active_rows([rest_orders]))
+
+
+def test_bulk_line_item_without_its_order_is_rejected():
+    objects = read_fixture()
+    with pytest.raises(ValueError):
+        list(iter_bulk_orders(objects[1:]))
+
+
+@pytest.mark.parametrize('updated_at_min', [None, '2020-06-01T00:00:00-04:00'])
+def test_bulk_export_matches_rest(mock_api, monkeypatch, updated_at_min):
+    server = mock_api(orders=600, latency=0, shopify_leak_rate=1000)
+    base_url = f'http://127.0.0.1:{server.server_address[1]}'
+    monkeypatch.setattr(update_active_table, 'SHOPIFY_API_URL', base_url)
+    monkeypatch.setattr(shopify_bulk, 'GRAPHQL_URL',
+                        f'{base_url}/admin/api/2021-07/graphql.json')
+
+    rest = active_rows(records for records, next_url in get_shopify_order_api(
+        endpoint='admin/api/2021-07/orders.json',
+        status='any',
+        updated_at_min=updated_at_min,
+    ))
+    bulk = active_rows(get_shopify_bulk_orders(updated_at_min=updated_at_min,
+                                               poll_interval=0))
+    assert len(rest) > 0
+    pd.testing.assert_frame_equal(bulk, rest)